@@ -1,26 +1,42 @@
+import hashlib
 import re
 
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
 from django.contrib import messages
 from django.urls import path, reverse
 from django.template.response import TemplateResponse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, PermissionDenied
 from django.utils.html import format_html
 from django.db import models
+from django.db.models import Prefetch, Count, Max, Q, Value
+from django.db.models.functions import Concat
+from django.utils.cache import add_never_cache_headers, get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.utils.text import camel_case_to_spaces
 from import_export.admin import ImportExportModelAdmin
 
 from django.contrib.contenttypes.admin import GenericTabularInline
 
-from .models import CrispriLibrary, File, Bookmark, Chemical, Manufacturer, StorageLocation, Primer, Plasmid, Strain, Stock, Tag, Protocol, Library, LibStock, Genome
-from .views import primer_add_multiple_view, create_library_view
+from .models import CrispriLibrary, File, Chemical, Manufacturer, StorageLocation, Primer, Plasmid, Strain, Stock, Tag, Protocol, Library, LibStock, Genome, ImportJob
+from .views import primer_add_multiple_view, chemical_add_multiple_view, create_library_view, update_library_view, export_library_view, plate_map_view
+from .resources import CrispriLibraryResource, IMPORT_FORMATS
+from .bookmarks import BOOKMARK_SECTIONS, is_bookmarked, add_bookmark, remove_bookmark
+from .fragments import fragment_key
+from .facets import FACET_FIELDS, facet_filter, facet_count
+from .pagination import KeysetPaginationMixin
+from .exports import csv_response, EXPORT_FORMATS, export_fields, export_header, export_rows, related_fields
+from .importers import get_batch_size
 
 class FileInline(GenericTabularInline):
     model = File
     extra = 0
 
-class BaseModelAdmin(admin.ModelAdmin):
+class BaseModelAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     # Admin site options
     actions = None # remove the "delete all selected" function
     list_display_links = None # no links directly to edit page
@@ -28,6 +44,38 @@ class BaseModelAdmin(admin.ModelAdmin):
     # Variable to be set in child classes to specify detail view template
     detail_template = None
 
+    # Fields written by the export view, or None for every field of the model
+    export_fields = None
+
+    # Related objects that detail_view loads along with the object, so that the detail template runs a fixed number of
+    # queries however many objects hang off it
+    detail_select_related = []
+    detail_prefetch_related = []
+
+    # Aggregates over the related objects shown on the detail page which, along with the object's updated time, tell
+    # whether the page has changed since a browser last loaded it. Related objects without an updated time are given
+    # as a tuple of lookups instead, whose values are all read into the version with one query per tuple.
+    detail_version = []
+
+    # Whether the object_body block of the detail page is cached, see fragments.py
+    cache_detail_body = True
+
+    # Loads the foreign keys shown by the changelist along with its rows: foreign key fields in list_display, plus the
+    # relations listed in the select_related attribute of display methods that follow them
+    def get_list_select_related(self, request):
+        if self.list_select_related is True:
+            return True
+        related = list(self.list_select_related or [])
+        for name in self.get_list_display(request):
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                related += getattr(getattr(self, name, None), 'select_related', [])
+                continue
+            if field.many_to_one or field.one_to_one:
+                related.append(name)
+        return related
+
     # override to remove edit and delete buttons on foreignkey fields
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -39,43 +87,108 @@ class BaseModelAdmin(admin.ModelAdmin):
     # override to add detail view page
     def get_urls(self):
         urls = super().get_urls()
-        view_urls = [path('<int:id>/view/', self.admin_site.admin_view(self.detail_view), name=self.model.__name__+"_view"),
-                     path('<int:id>/add_bookmark/', self.admin_site.admin_view(self.add_bookmark_view), name=self.model.__name__+"_addbookmark"),
-                     path('<int:id>/remove_bookmark/', self.admin_site.admin_view(self.remove_bookmark_view), name=self.model.__name__+"_removebookmark")]
+        view_urls = [path('<int:id>/view/', self.admin_site.admin_view(self.detail_view, cacheable=True), name=self.model.__name__+"_view"),
+                     path('export/<str:format>/', self.admin_site.admin_view(self.export_view),
+                          name='%s_%s_export' % (self.model._meta.app_label, self.model._meta.model_name))]
+        if self.can_bookmark():
+            view_urls += [path('<int:id>/add_bookmark/', self.admin_site.admin_view(self.add_bookmark_view), name=self.model.__name__+"_addbookmark"),
+                          path('<int:id>/remove_bookmark/', self.admin_site.admin_view(self.remove_bookmark_view), name=self.model.__name__+"_removebookmark")]
         return view_urls + urls
+
+    # Only models listed on the bookmarks page can be bookmarked, which also have the bookmarks GenericRelation that
+    # deletes their bookmarks with them
+    def can_bookmark(self):
+        return self.model._meta.model_name in BOOKMARK_SECTIONS
     
+    def get_detail_object(self, request, id, prefetch=True):
+        queryset = self.get_queryset(request)
+        if self.detail_select_related:
+            queryset = queryset.select_related(*self.detail_select_related)
+        if prefetch and self.detail_prefetch_related:
+            queryset = queryset.prefetch_related(*self.detail_prefetch_related)
+        return queryset.filter(pk=id).first()
+
+    def get_detail_version(self, request, id, bookmarked):
+        # Returns None for models without an updated time, whose changes can't be detected
+        if not any(field.name == 'updated' for field in self.model._meta.concrete_fields):
+            return None
+        queryset = self.get_queryset(request).filter(pk=id)
+        aggregates = {'version%d' % i: aggregate for i, aggregate in enumerate(self.detail_version) if not isinstance(aggregate, tuple)}
+        values = queryset.aggregate(updated=Max('updated'), **aggregates)
+        if values['updated'] is None:
+            return None
+        last_modified = max(value for value in values.values() if hasattr(value, 'timestamp'))
+        related = [list(queryset.order_by(*lookups).values_list(*lookups)) for lookups in self.detail_version if isinstance(lookups, tuple)]
+        # The page also depends on who is looking at it and whether they bookmarked it
+        version = repr((sorted(values.items()), related, request.user.pk, bookmarked, self.detail_template))
+        return int(last_modified.timestamp()), quote_etag(hashlib.md5(version.encode()).hexdigest())
+
     # view for object detail page
     def detail_view(self, request, id):
         if self.detail_template != None:
-            object = self.get_object(request, id)
-            is_bookmarked = False
-            for bookmark in request.user.bookmark_set.all():
-                if bookmark.content_object == object:
-                    is_bookmarked = True
-            context = dict(self.admin_site.each_context(request), object=object, object_type=camel_case_to_spaces(self.model.__name__), is_bookmarked=is_bookmarked)
-            return TemplateResponse(request, self.detail_template, context)
+            bookmarked = self.can_bookmark() and is_bookmarked(request.user, self.model, id)
+            # Pages showing messages are always rendered in full, so that a message is never shown from the browser cache
+            version = None if len(messages.get_messages(request)) else self.get_detail_version(request, id, bookmarked)
+            if version is not None:
+                last_modified, etag = version
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is not None:
+                    return response
+
+            # The related objects listed in object_body only need loading when it isn't cached
+            body_key = fragment_key(self.model, id) if self.cache_detail_body else None
+            body = cache.get(body_key) if body_key else None
+            object = self.get_detail_object(request, id, prefetch=body is None)
+            context = dict(self.admin_site.each_context(request), object=object, object_type=camel_case_to_spaces(self.model.__name__),
+                           can_bookmark=self.can_bookmark(), is_bookmarked=bookmarked, object_body_key=body_key, object_body=body)
+            response = TemplateResponse(request, self.detail_template, context)
+            # detail_view sets its own cache headers instead of the admin's never_cache, which stops browsers from keeping
+            # the page at all
+            if version is not None:
+                response['Last-Modified'] = http_date(last_modified)
+                response['ETag'] = etag
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                add_never_cache_headers(response)
+            return response
         else:
             # Placeholder for if child class does not specify a template
             return HttpResponse("Detail template missing for this object type")
     
     def add_bookmark_view(self, request, id):
-        new_bookmark = Bookmark(user=request.user, content_object=self.get_object(request, id))
-        new_bookmark.save()
+        add_bookmark(request.user, self.model, id)
         messages.success(request, "Bookmark added")
         return HttpResponseRedirect("../view")
 
     def remove_bookmark_view(self, request, id):
-        for bookmark in request.user.bookmark_set.all():
-            if bookmark.content_object == self.get_object(request, id):
-                bookmark.delete()
+        remove_bookmark(request.user, self.model, id)
         messages.error(request, "Bookmark removed")
         return HttpResponseRedirect("../view")
 
+    # Streams the rows of the changelist, with its current search, filters and date drilldown applied
+    def export_view(self, request, format):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if format not in EXPORT_FORMATS:
+            return HttpResponse("Unknown export format", status=404)
+        try:
+            changelist = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            return HttpResponseRedirect(reverse('admin:%s_%s_changelist' % (self.model._meta.app_label, self.model._meta.model_name)) + '?e=1')
+        fields = export_fields(self.model, self.export_fields)
+        queryset = changelist.get_queryset(request).select_related(*related_fields(fields))
+        rows = export_rows(queryset.iterator(chunk_size=get_batch_size()), fields)
+        extension, response = EXPORT_FORMATS[format]
+        filename = "%s.%s" % (self.model._meta.verbose_name_plural.strip().lower().replace(" ", "_"), extension)
+        return response(filename, export_header(fields), rows)
+
 class TrackCreatorAdmin(BaseModelAdmin):
     date_hierarchy = 'created'
     #readonly_fields = ['creator']
     exclude = ['creator']
 
+    detail_select_related = ['creator']
+
     # override to automatically set object's creator
     def save_model(self, request, obj, form, change):
         if (not change):
@@ -89,6 +202,7 @@ class ManufacturerAdmin(BaseModelAdmin):
     list_display = ['name_link']
 
     detail_template = "cardonalab/manufacturer_detail.html"
+    detail_prefetch_related = ['chemical_set']
 
     def name_link(self, obj):
         return format_html("<a href=%s>%s</a>" % (reverse("admin:Manufacturer_view", args=[obj.id]), obj.name))
@@ -101,11 +215,22 @@ class StorageLocationAdmin(BaseModelAdmin):
     list_display = ['name_link']
 
     detail_template = "cardonalab/location_detail.html"
+    detail_prefetch_related = ['chemical_set']
 
     def name_link(self, obj):
         return format_html("<a href=%s>%s</a>" % (reverse("admin:StorageLocation_view", args=[obj.id]), obj.name))
     name_link.short_description = 'Storage Location'
 
+class ChemicalChangeList(ChangeList):
+    # Codes sort by label and then number, both in the direction clicked, so that A2 comes before A10
+    def get_ordering(self, request, queryset):
+        ordering = []
+        for field in super().get_ordering(request, queryset):
+            ordering.append(field)
+            if field in ('label', '-label'):
+                ordering.append(field.replace('label', 'number'))
+        return ordering
+
 class ChemicalAdmin(TrackCreatorAdmin):
     list_display = ['code_link', 'name', 'location', 'in_stock']
     search_fields = ['name'] # can also search for code because of override method below
@@ -113,19 +238,31 @@ class ChemicalAdmin(TrackCreatorAdmin):
     autocomplete_fields = ['manufacturer', 'location']
 
     detail_template = "cardonalab/chemical_detail.html"
+    detail_select_related = ['creator', 'manufacturer', 'location']
+    detail_version = [Max('manufacturer__name'), Max('location__name')]
 
     def code_link(self, obj):
-        return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:Chemical_view", args=[obj.id]), obj.code()))
+        return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:Chemical_view", args=[obj.id]), obj.code))
     code_link.short_description = 'code'
-    code_link.admin_order_field = models.functions.Concat('label', 'number')
+    code_link.admin_order_field = 'label'
+
+    def get_changelist(self, request, **kwargs):
+        return ChemicalChangeList
 
-    # override to allow searching by code
+    # override to allow searching by code: a search that is exactly an existing code finds just that chemical through
+    # the index on code, anything else is searched for in names
     def get_search_results(self, request, queryset, search_term):
-        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
-        codematch = re.fullmatch("([A-Z])([1-9]+)", search_term, re.I)
+        codematch = re.fullmatch("([A-Z])0*([0-9]+)", search_term.strip(), re.I)
         if codematch is not None:
-            queryset |= self.model.objects.filter(label=codematch.group(1).upper(), number=int(codematch.group(2)))
-        return queryset, use_distinct
+            by_code = queryset.filter(code=Chemical.make_code(codematch.group(1).upper(), int(codematch.group(2))))
+            if by_code.exists():
+                return by_code, False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        new_url = [path('add_multiple', self.admin_site.admin_view(chemical_add_multiple_view), name='chemical_add_multiple')]
+        return new_url + urls
 
     class Media:
         js = ["cardonalab/chem_label_autoupdate.js"]
@@ -134,6 +271,7 @@ class PrimerAdmin(TrackCreatorAdmin):
     list_display = ['id_link', 'template', 'location', 'tm', 'restriction_sites', 'notes']
     list_filter = ['creator']
     search_fields = ['template', 'location', 'id', 'restriction_sites', 'notes']
+    keyset_pagination = True
 
     detail_template = "cardonalab/primer_detail.html"
 
@@ -156,6 +294,9 @@ class PlasmidAdmin(TrackCreatorAdmin):
     inlines = [FileInline]
 
     detail_template = "cardonalab/plasmid_detail.html"
+    detail_prefetch_related = ['files', 'primers', Prefetch('stock_set', queryset=Stock.objects.select_related('strain'))]
+    detail_version = [('files__id', 'files__file'), Count('primers', distinct=True), Max('primers__updated'),
+                      Count('stock', distinct=True), Max('stock__updated'), Max('stock__strain__updated')]
 
     def name_link(self, obj):
         return format_html("<a href=%s>%s</a>" % (reverse("admin:Plasmid_view", args=[obj.id]), obj.name))
@@ -168,6 +309,8 @@ class StrainAdmin(TrackCreatorAdmin):
     inlines = [FileInline]
 
     detail_template = "cardonalab/strain_detail.html"
+    detail_prefetch_related = ['files', Prefetch('stock_set', queryset=Stock.objects.select_related('plasmid'))]
+    detail_version = [('files__id', 'files__file'), Count('stock', distinct=True), Max('stock__updated'), Max('stock__plasmid__updated')]
 
     def name_link(self, obj):
         return format_html("<a href=%s>%s</a>" % (reverse("admin:Strain_view", args=[obj.id]), obj.name))
@@ -180,6 +323,8 @@ class StockAdmin(TrackCreatorAdmin):
     autocomplete_fields = ['strain', 'plasmid']
 
     detail_template = "cardonalab/stock_detail.html"
+    detail_select_related = ['creator', 'strain', 'plasmid']
+    detail_version = [Max('strain__updated'), Max('plasmid__updated')]
 
     def id_link(self, obj):
         return format_html("<a href=%s><b>%d</b></a>" % (reverse("admin:Stock_view", args=[obj.id]), obj.id))
@@ -193,6 +338,7 @@ class StockAdmin(TrackCreatorAdmin):
             return ""
     strain_link.short_description = 'strain'
     strain_link.admin_order_field = 'strain'
+    strain_link.select_related = ['strain']
 
     def plasmid_link(self, obj):
         if obj.plasmid:
@@ -201,6 +347,7 @@ class StockAdmin(TrackCreatorAdmin):
             return ""
     plasmid_link.short_description = 'plasmid'
     plasmid_link.admin_order_field = 'plasmid'
+    plasmid_link.select_related = ['plasmid']
 
 class TagAdmin(BaseModelAdmin):
     actions = None
@@ -209,6 +356,7 @@ class TagAdmin(BaseModelAdmin):
     search_fields = ['name']
 
     detail_template = "cardonalab/tag_detail.html"
+    detail_prefetch_related = ['protocol_set']
 
     def tag_link(self, obj):
         return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:Tag_view", args=[obj.id]), obj.name))
@@ -222,6 +370,8 @@ class ProtocolAdmin(TrackCreatorAdmin):
     inlines = [FileInline]
 
     detail_template = "cardonalab/protocol_detail.html"
+    detail_prefetch_related = ['files', 'tags']
+    detail_version = [('files__id', 'files__file'), ('tags__id', 'tags__name')]
 
     def title_link(self, obj):
         return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:Protocol_view", args=[obj.id]), obj.title))
@@ -232,31 +382,66 @@ class ProtocolAdmin(TrackCreatorAdmin):
         js = ["tinymce/js/tinymce/tinymce.min.js", "cardonalab/protocol_text_editor.js"]
 
 class LibraryAdmin(BaseModelAdmin):
-    list_display = ['name_link', 'num_stocks']
+    list_display = ['name_link', 'num_stocks', 'plates_used', 'wells_filled', 'num_species']
     ordering = ['name']
     search_fields = ['name']
 
+    # Summary stats of every library on the page come from a single grouped query over its stocks
+    def get_queryset(self, request):
+        well = Concat('libstock__plate', Value('-'), 'libstock__letter', 'libstock__number', output_field=models.CharField())
+        # Libraries still being filled by their import job are left out until it finishes
+        importing = ImportJob.objects.filter(kind=ImportJob.LIBRARY, status=ImportJob.RUNNING, library__isnull=False)
+        return super().get_queryset(request).exclude(pk__in=importing.values('library')).annotate(
+            stock_count=Count('libstock'),
+            plate_count=Count('libstock__plate', distinct=True),
+            # Concat turns the NULLs of a library without stocks into '-', which would count as a well
+            well_count=Count(well, distinct=True, filter=Q(libstock__isnull=False)),
+            species_count=Count('libstock__species', distinct=True),
+        )
+
     def name_link(self, obj):
         return format_html("<a href=%s?library__id__exact=%d><b>%s</b></a>" % (reverse("admin:cardonalab_libstock_changelist"), obj.id, obj.name))
     name_link.short_description = 'name'
     name_link.admin_order_field = 'name'
 
     def num_stocks(self, obj):
-        return obj.libstock_set.count()
+        return obj.stock_count
     num_stocks.short_description = 'number of stocks'
+    num_stocks.admin_order_field = 'stock_count'
+
+    def plates_used(self, obj):
+        return obj.plate_count
+    plates_used.short_description = 'plates'
+    plates_used.admin_order_field = 'plate_count'
+
+    def wells_filled(self, obj):
+        return obj.well_count
+    wells_filled.short_description = 'wells filled'
+    wells_filled.admin_order_field = 'well_count'
+
+    def num_species(self, obj):
+        return obj.species_count
+    num_species.short_description = 'species'
+    num_species.admin_order_field = 'species_count'
 
     # override to include the "create from file" page
     def get_urls(self):
         urls = super().get_urls()
-        new_url = [path('add/', self.admin_site.admin_view(create_library_view), name='create_library')]
+        new_url = [path('add/', self.admin_site.admin_view(create_library_view), name='create_library'),
+                   path('<int:id>/update/', self.admin_site.admin_view(update_library_view), name='update_library'),
+                   path('<int:id>/export/', self.admin_site.admin_view(export_library_view), name='export_library'),
+                   path('<int:id>/plates/', self.admin_site.admin_view(plate_map_view), name='library_plates'),
+                   path('<int:id>/plates/<int:plate>/', self.admin_site.admin_view(plate_map_view), name='library_plate')]
         return new_url + urls
 
 class LibStockAdmin(BaseModelAdmin):
     list_display = ['stock_id_link', 'location', 'species', 'gene_target', 'forward_primer_link', 'resistance', 'notes']
     list_filter = ['library']
     ordering = ['library', 'stock_id']
+    keyset_pagination = True
 
     detail_template = "cardonalab/libstock_detail.html"
+    detail_select_related = ['library', 'forward_primer']
 
     def stock_id_link(self, obj):
         return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:LibStock_view", args=[obj.id]), obj.stock_id))
@@ -270,6 +455,7 @@ class LibStockAdmin(BaseModelAdmin):
             return ""
     forward_primer_link.short_description = 'forward primer'
     forward_primer_link.admin_order_field = 'forward_primer_id'
+    forward_primer_link.select_related = ['forward_primer']
 
     # This override makes this model type not appear on the admin index page
     def get_model_perms(self, request):
@@ -292,6 +478,8 @@ class GenomeAdmin(TrackCreatorAdmin):
     inlines = [FileInline]
 
     detail_template = "cardonalab/genome_detail.html"
+    detail_prefetch_related = ['files']
+    detail_version = [('files__id', 'files__file')]
 
     def title_link(self, obj):
         return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:Genome_view", args=[obj.id]), obj.title))
@@ -302,12 +490,66 @@ class GenomeAdmin(TrackCreatorAdmin):
         js = ["tinymce/js/tinymce/tinymce.min.js", "cardonalab/protocol_text_editor.js"]
 
 
-class CrispriLibraryAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class ImportJobAdmin(BaseModelAdmin):
+    list_display = ['job_link', 'status', 'creator', 'created', 'rows_processed', 'library']
+    list_filter = ['kind', 'status', 'creator']
+    date_hierarchy = 'created'
+
+    detail_template = "cardonalab/importjob_detail.html"
+    detail_select_related = ['creator', 'library']
+    # Progress is written with update(), which fragments can't track
+    cache_detail_body = False
+
+    def job_link(self, obj):
+        return format_html("<a href=%s><b>%s</b></a>" % (reverse("admin:ImportJob_view", args=[obj.id]), obj))
+    job_link.short_description = 'job'
+    job_link.admin_order_field = 'id'
+
+    # Jobs are created by the upload pages and only ever changed by the import worker
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    # The page shows the time elapsed so far, so it is never answered from the browser cache
+    def get_detail_version(self, request, id, bookmarked):
+        return None
+
+class CrispriLibraryAdmin(KeysetPaginationMixin, ImportExportModelAdmin, admin.ModelAdmin):
     list_display = ['boxNo','plate','wellLetter','wellNo', 'locusTag', 'downStreamGene', 'forwardPrimer','species','resistance','essential','growthDefect','notes']
-    search_fields = ['boxNo','plate','wellLetter','wellNo', 'locusTag', 'downStreamGene', 'forwardPrimer','species','resistance','essential','growthDefect','notes']
-    list_filter = ['boxNo','plate','wellLetter','wellNo', 'locusTag', 'downStreamGene', 'forwardPrimer','species','resistance','essential','growthDefect','notes']
-    sortable_by = ['boxNo','plate','wellLetter','wellNo', 'locusTag', 'downStreamGene', 'forwardPrimer','species','resistance','essential','growthDefect','notes']
+    # Prefix and exact matches on the identifying columns, which have indexes, instead of a substring match on all of them
+    search_fields = ['^locusTag', '^downStreamGene', '=forwardPrimer']
+    # Filter choices and their counts come from CrispriFacet rather than a scan of the library per filter
+    list_filter = [facet_filter(field) for field in FACET_FIELDS]
+    sortable_by = ['boxNo', 'plate', 'locusTag', 'downStreamGene']
+    ordering = ['plate', 'wellLetter', 'wellNo']
+    keyset_pagination = True
     inlines = [FileInline]
+    import_formats = IMPORT_FORMATS
+    resource_classes = [CrispriLibraryResource]
+    # import-export wraps this template with its own import and export buttons
+    change_list_template = "admin/cardonalab/crisprilibrary/change_list.html"
+
+    # Totals that CrispriFacet already counts are read from it
+    def estimate_count(self, request, queryset, params):
+        count = facet_count({key: value for key, value in params.items() if key != ORDER_VAR})
+        return super().estimate_count(request, queryset, params) if count is None else count
+
+    # override to include the streaming CSV export
+    def get_urls(self):
+        urls = super().get_urls()
+        new_url = [path('export_csv/', self.admin_site.admin_view(self.export_csv_view), name='CrispriLibrary_export_csv')]
+        return new_url + urls
+
+    # Streams the filtered changelist one chunk of rows at a time instead of building a tablib dataset in memory
+    def export_csv_view(self, request):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        resource = CrispriLibraryResource()
+        queryset = self.get_export_queryset(request)
+        rows = (resource.export_resource(obj) for obj in resource.iter_queryset(queryset))
+        return csv_response("crispri_library.csv", resource.get_export_headers(), rows)
 
 
 
@@ -324,4 +566,5 @@ admin.site.register(Protocol, ProtocolAdmin)
 admin.site.register(Library, LibraryAdmin)
 admin.site.register(LibStock, LibStockAdmin)
 admin.site.register(Genome, GenomeAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
 admin.site.register(CrispriLibrary, CrispriLibraryAdmin)
\ No newline at end of file
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class CardonalabConfig(AppConfig):
     name = 'cardonalab'
+
+    def ready(self):
+        from . import checks, signals
+        from django.conf import settings
+        # Carry on with the imports left behind by the last restart
+        if getattr(settings, 'CARDONALAB_IMPORT_START_RUNNER', False):
+            from .jobs import start_runner
+            start_runner()
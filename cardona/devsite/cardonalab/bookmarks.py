@@ -0,0 +1,98 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from .models import Bookmark
+
+# Bookmarkable models by ContentType.model: the section of the bookmarks page they are listed in, and the related
+# objects its table shows
+BOOKMARK_SECTIONS = {
+    'chemical': ('chemicals', ['manufacturer', 'location']),
+    'manufacturer': ('manufacturers', []),
+    'storagelocation': ('locations', []),
+    'primer': ('primers', []),
+    'plasmid': ('plasmids', []),
+    'strain': ('strains', []),
+    'stock': ('stocks', ['strain', 'plasmid']),
+    'libstock': ('libstocks', ['library', 'forward_primer']),
+    'genome': ('genomes', []),
+    'protocol': ('protocols', []),
+    'tag': ('tags', []),
+}
+
+CACHE_TIMEOUT = 24 * 60 * 60
+
+def _cache_key(user_id):
+    return 'cardonalab:bookmarks:%s' % user_id
+
+def get_bookmark_keys(user):
+    # (content_type_id, object_id) pairs, oldest first, cached until a bookmark of the user changes (see signals.py)
+    if user.pk is None:
+        # Anonymous users have no bookmarks
+        return []
+    key = _cache_key(user.pk)
+    pairs = cache.get(key)
+    if pairs is None:
+        pairs = list(Bookmark.objects.filter(user=user).order_by('id').values_list('content_type_id', 'object_id'))
+        cache.set(key, pairs, CACHE_TIMEOUT)
+    return pairs
+
+def get_bookmark_set(user):
+    # Built once per user object, so once per request for request.user
+    pairs = getattr(user, '_bookmark_set', None)
+    if pairs is None:
+        pairs = user._bookmark_set = frozenset(get_bookmark_keys(user))
+    return pairs
+
+def forget_bookmarks(user_id):
+    cache.delete(_cache_key(user_id))
+
+def _forget_bookmark_set(user):
+    user.__dict__.pop('_bookmark_set', None)
+
+def get_bookmarked_objects(user):
+    # One in_bulk query per content type, listing objects in the order they were bookmarked. Bookmarks of objects that
+    # no longer exist are left out, see delete_dangling_bookmarks.
+    object_ids = defaultdict(list)
+    for content_type_id, object_id in get_bookmark_keys(user):
+        object_ids[content_type_id].append(object_id)
+
+    bookmarks = {section: [] for section, related in BOOKMARK_SECTIONS.values()}
+    for content_type_id, ids in object_ids.items():
+        content_type = ContentType.objects.get_for_id(content_type_id) # cached after the first lookup
+        if content_type.model not in BOOKMARK_SECTIONS:
+            continue
+        section, related = BOOKMARK_SECTIONS[content_type.model]
+        objects = content_type.model_class().objects.select_related(*related).in_bulk(ids)
+        bookmarks[section] = [objects[object_id] for object_id in ids if object_id in objects]
+    return bookmarks
+
+def delete_dangling_bookmarks():
+    # Deleting an object through the ORM deletes its bookmarks too, this is for objects deleted any other way. Returns
+    # the number of bookmarks deleted.
+    deleted = 0
+    for content_type_id in Bookmark.objects.order_by().values_list('content_type_id', flat=True).distinct():
+        bookmarks = Bookmark.objects.filter(content_type_id=content_type_id)
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            bookmarks = bookmarks.exclude(object_id__in=model._base_manager.values('pk'))
+        # Deleted one by one, so that post_delete clears the cached bookmarks of their users
+        deleted += bookmarks.delete()[0]
+    return deleted
+
+def _bookmarks_of(user, model, object_id):
+    return Bookmark.objects.filter(user=user, content_type=ContentType.objects.get_for_model(model), object_id=object_id)
+
+def is_bookmarked(user, model, object_id):
+    return (ContentType.objects.get_for_model(model).pk, int(object_id)) in get_bookmark_set(user)
+
+def add_bookmark(user, model, object_id):
+    bookmark = Bookmark(user=user, content_type=ContentType.objects.get_for_model(model), object_id=object_id)
+    Bookmark.objects.bulk_create([bookmark], ignore_conflicts=True)
+    forget_bookmarks(user.pk) # bulk_create doesn't send post_save
+    _forget_bookmark_set(user)
+
+def remove_bookmark(user, model, object_id):
+    _bookmarks_of(user, model, object_id).delete()
+    _forget_bookmark_set(user)
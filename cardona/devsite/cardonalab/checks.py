@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Cache backends whose entries can only be seen by the process that wrote them
+PROCESS_LOCAL_CACHES = ['django.core.cache.backends.locmem.LocMemCache']
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Imports run by the run_import_jobs command clear cached detail pages, which only works through a shared cache"""
+    if getattr(settings, 'CARDONALAB_IMPORT_RUNNER', 'thread') != 'command':
+        return []
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning("Import jobs run in a separate process, whose changes can't clear the cached detail pages of the "
+                    "web server with a process-local cache",
+                    hint="Use a shared cache backend such as Memcached, Redis or the database cache",
+                    id='cardonalab.W001')]
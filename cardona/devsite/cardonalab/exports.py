@@ -0,0 +1,88 @@
+import csv
+import datetime
+import tempfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.fields.files import FieldFile
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.utils.text import capfirst
+
+class _Echo:
+    """File-like object that returns what is written to it, so csv.writer output can be streamed line by line"""
+    def write(self, value):
+        return value
+
+def csv_response(filename, header, rows):
+    """Streams rows as a CSV attachment; rows can be any iterable and is only consumed as the response is sent"""
+    writer = csv.writer(_Echo())
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+def xlsx_response(filename, header, rows, title="Sheet1"):
+    # Write-only mode writes each row out as it is added, spooled to a temporary file rather than held in memory
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename,
+                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+def ndjson_response(filename, header, rows):
+    """Streams rows as newline-delimited JSON, one object per row keyed by the header"""
+    encoder = DjangoJSONEncoder()
+    def lines():
+        for row in rows:
+            yield encoder.encode(dict(zip(header, row))) + "\n"
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+# Format name in the export URL -> (file extension, response function)
+EXPORT_FORMATS = {
+    'csv': ('csv', csv_response),
+    'json': ('ndjson', ndjson_response),
+    'xlsx': ('xlsx', xlsx_response),
+}
+
+### Exporting model instances
+
+def export_fields(model, names=None):
+    """Returns the fields exported for a model: the named fields, or every concrete field"""
+    if names is not None:
+        return [model._meta.get_field(name) for name in names]
+    return list(model._meta.concrete_fields)
+
+def export_header(fields):
+    return [capfirst(str(field.verbose_name)) for field in fields]
+
+def related_fields(fields):
+    """Names of the foreign keys among fields, to be loaded with select_related"""
+    return [field.name for field in fields if field.many_to_one or field.one_to_one]
+
+def _export_value(obj, field):
+    if field.many_to_one or field.one_to_one:
+        related = getattr(obj, field.name)
+        return None if related is None else str(related)
+    value = field.value_from_object(obj)
+    if isinstance(value, FieldFile):
+        return value.name or None
+    if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+        # Excel has no time zones, so every format gets the local time shown in the admin
+        return timezone.make_naive(value)
+    return value
+
+def export_rows(objects, fields):
+    for obj in objects:
+        yield [_export_value(obj, field) for field in fields]
@@ -0,0 +1,98 @@
+from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import CrispriLibrary, CrispriFacet
+
+# CrispriLibrary columns with a filter on the changelist, whose value counts are kept in CrispriFacet
+FACET_FIELDS = ['boxNo', 'plate', 'species', 'resistance', 'essential', 'growthDefect']
+
+def facet_value(value):
+    """The text a column value is counted under, '' for empty and missing values"""
+    return '' if value is None else str(value)
+
+def facet_values(library):
+    return {field: facet_value(getattr(library, field)) for field in FACET_FIELDS}
+
+### Keeping counts current
+
+def _add(field, value, delta):
+    updated = CrispriFacet.objects.filter(field=field, value=value).update(count=F('count') + delta)
+    if not updated and delta > 0:
+        facet, created = CrispriFacet.objects.get_or_create(field=field, value=value, defaults={'count': delta})
+        if not created:
+            CrispriFacet.objects.filter(pk=facet.pk).update(count=F('count') + delta)
+
+def update_facets(old=None, new=None):
+    """Moves a row's counts from the facet values in old to those in new, either of which can be None"""
+    for field in FACET_FIELDS:
+        before = old[field] if old else None
+        after = new[field] if new else None
+        if before == after:
+            continue
+        if before is not None:
+            _add(field, before, -1)
+        if after is not None:
+            _add(field, after, 1)
+
+def refresh_facets():
+    """Recounts every facet from the library, one grouped query per column, for use after bulk writes"""
+    facets = []
+    for field in FACET_FIELDS:
+        counts = CrispriLibrary.objects.order_by().values_list(field).annotate(count=Count('pk'))
+        facets.extend(CrispriFacet(field=field, value=facet_value(value), count=count) for value, count in counts)
+    with transaction.atomic():
+        CrispriFacet.objects.all().delete()
+        CrispriFacet.objects.bulk_create(facets)
+
+def facet_count(filters):
+    # CrispriFacet only holds the count for no filters or a single facet filter; None otherwise
+    if not filters:
+        return CrispriFacet.objects.filter(field=FACET_FIELDS[0]).aggregate(count=Sum('count'))['count'] or 0
+    if len(filters) == 1:
+        (field, value), = filters.items()
+        if field in FACET_FIELDS:
+            return CrispriFacet.objects.filter(field=field, value=value).values_list('count', flat=True).first() or 0
+    return None
+
+### Changelist filters
+
+def _get_facets(request):
+    # Every filter of the page shares one query
+    if not hasattr(request, '_crispri_facets'):
+        request._crispri_facets = {}
+        for field, value, count in CrispriFacet.objects.filter(count__gt=0).values_list('field', 'value', 'count'):
+            request._crispri_facets.setdefault(field, []).append((value, count))
+    return request._crispri_facets
+
+class FacetListFilter(admin.SimpleListFilter):
+    """Filters the changelist by the values of one column, as counted in CrispriFacet"""
+    field = None
+
+    def lookups(self, request, model_admin):
+        model_field = CrispriLibrary._meta.get_field(self.field)
+        values = [(model_field.to_python(value) if value else None, count) for value, count in _get_facets(request).get(self.field, [])]
+        values.sort(key=lambda item: (item[0] is None, item[0]))
+        return [(facet_value(value), "%s (%d)" % (self._label(value), count)) for value, count in values]
+
+    @staticmethod
+    def _label(value):
+        if value is None or value == '':
+            return "(empty)"
+        if isinstance(value, bool):
+            return "Yes" if value else "No"
+        return value
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value is None:
+            return queryset
+        model_field = CrispriLibrary._meta.get_field(self.field)
+        if value == '':
+            return queryset.filter(**{self.field + '__isnull': True} if model_field.null else {self.field: ''})
+        return queryset.filter(**{self.field: model_field.to_python(value)})
+
+def facet_filter(field):
+    """Returns a changelist filter class for one of FACET_FIELDS"""
+    title = CrispriLibrary._meta.get_field(field).verbose_name
+    return type('%sFacetListFilter' % field, (FacetListFilter,), {'field': field, 'title': title, 'parameter_name': field})
@@ -0,0 +1,57 @@
+import uuid
+
+from django.core.cache import cache
+
+from .models import Chemical, Manufacturer, StorageLocation, Primer, Plasmid, Strain, Stock, Tag, Protocol, Library
+
+# How long a rendered object_body block is kept
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+# For each model, the lookups to the objects whose detail pages show it. Saving or deleting an object clears their
+# cached fragments as well as its own.
+FRAGMENT_DEPENDENCIES = {
+    Chemical: ['manufacturer', 'location'],     # manufacturer and location pages list their chemicals
+    Manufacturer: ['chemical'],                 # chemical pages show the manufacturer and location names
+    StorageLocation: ['chemical'],
+    Primer: ['plasmid', 'libstock'],            # plasmid pages list their primers, library stock pages their forward primer
+    Plasmid: ['stock', 'stock__strain'],        # stock pages show the plasmid, strain pages the plasmids of their stocks
+    Strain: ['stock', 'stock__plasmid'],
+    Stock: ['strain', 'plasmid'],               # strain and plasmid pages list their stocks
+    Tag: ['protocol'],                          # protocol pages list their tags and tag pages their protocols
+    Protocol: ['tags'],
+    Library: ['libstock'],                      # a library stock's name includes its library's
+}
+
+def _version_key(model, pk):
+    return 'cardonalab:fragment-version:%s:%s' % (model._meta.label_lower, pk)
+
+def fragment_key(model, pk):
+    # The version is replaced whenever the page's objects change, so stale fragments are never read again and expire
+    version_key = _version_key(model, pk)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, FRAGMENT_TIMEOUT)
+        version = cache.get(version_key)
+    return 'cardonalab:fragment:%s:%s:%s' % (model._meta.label_lower, pk, version)
+
+def invalidate_fragments(model, pks):
+    """Clears the cached detail page fragments of the objects of model with the given pks"""
+    keys = [_version_key(model, pk) for pk in pks if pk is not None]
+    if keys:
+        cache.delete_many(keys)
+
+def _related_model(model, lookup):
+    for name in lookup.split('__'):
+        model = model._meta.get_field(name).related_model
+    return model
+
+def dependent_fragments(instance):
+    """Returns (model, pks) for every kind of object whose detail page shows instance, as currently saved"""
+    model = type(instance)
+    queryset = model._base_manager.filter(pk=instance.pk)
+    return [(_related_model(model, lookup), set(queryset.values_list(lookup, flat=True)))
+            for lookup in FRAGMENT_DEPENDENCIES.get(model, [])]
+
+def invalidate_dependent_fragments(dependents):
+    for model, pks in dependents:
+        invalidate_fragments(model, pks)
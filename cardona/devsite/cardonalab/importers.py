@@ -0,0 +1,373 @@
+import json
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, DELETION
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.functions import Lower
+
+from .models import Primer, Library, LibStock, Chemical, ChemicalCounter, Manufacturer, StorageLocation
+from . import validation
+from .validation import check_primer_sheet, check_chemical_sheet, check_library_sheet, check_primer_references, check_library_workbook_sheet, merge_library_sheets
+from .spreadsheets import sheet_names
+from .fragments import invalidate_fragments
+
+DEFAULT_BATCH_SIZE = 500
+# Starting worker processes takes longer than checking the sheets of smaller workbooks
+PARALLEL_MIN_FILE_SIZE = 1024 * 1024
+
+class RowErrors(Exception):
+    """Raised when rows of an uploaded sheet fail validation; nothing is written to the database"""
+    def __init__(self, report):
+        self.report = report
+        self.rows = report.rows
+        super().__init__("File contains errors in the following row(s): " + str(self.rows))
+
+    def describe(self):
+        lines = []
+        for error in self.report.sorted_errors():
+            location = 'Sheet "%s", row %d' % (error.sheet, error.row) if error.sheet else "Row %d" % error.row
+            lines.append("%s, %s: %s" % (location, error.column, error.message))
+        return "\n".join([str(self), ""] + lines)
+
+def get_batch_size(batch_size=None):
+    if batch_size is None:
+        batch_size = getattr(settings, 'CARDONALAB_IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    return max(1, int(batch_size))
+
+def get_sheet_workers(workers=None):
+    if workers is None:
+        workers = getattr(settings, 'CARDONALAB_IMPORT_PROCESSES', None) or os.cpu_count() or 1
+    return max(1, int(workers))
+
+def get_parallel_min_size(min_size=None):
+    if min_size is None:
+        min_size = getattr(settings, 'CARDONALAB_IMPORT_PARALLEL_MIN_SIZE', PARALLEL_MIN_FILE_SIZE)
+    return max(0, int(min_size))
+
+def batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+def report_progress(progress, count, batch_size):
+    if progress is not None and count and count % batch_size == 0:
+        progress(count)
+
+def read_rows(rows, progress=None, batch_size=None):
+    batch_size = get_batch_size(batch_size)
+    collected = []
+    for row in rows:
+        collected.append(row)
+        report_progress(progress, len(collected), batch_size)
+    if progress is not None:
+        progress(len(collected))
+    return collected
+
+def _ranges(ids):
+    ranges = []
+    for pk in sorted(ids):
+        if ranges and pk == ranges[-1][1] + 1:
+            ranges[-1][1] = pk
+        else:
+            ranges.append([pk, pk])
+    return ranges
+
+def format_id_ranges(ids):
+    # [1, 2, 3, 7, 9, 10] -> "1 - 3, 7, 9 - 10"
+    return ", ".join(str(start) if start == end else "%d - %d" % (start, end) for start, end in _ranges(ids))
+
+def format_codes(chemicals):
+    # e.g. "A12 - A14, B3"
+    numbers = {}
+    for chemical in chemicals:
+        numbers.setdefault(chemical.label, []).append(chemical.number)
+    return ", ".join(Chemical.make_code(label, start) if start == end
+                     else "%s - %s" % (Chemical.make_code(label, start), Chemical.make_code(label, end))
+                     for label in sorted(numbers) for start, end in _ranges(numbers[label]))
+
+def bulk_insert(model, objects, batch_size):
+    for batch in batches(objects, batch_size):
+        if connection.features.can_return_rows_from_bulk_insert:
+            model.objects.bulk_create(batch)
+        else:
+            # Backends such as MySQL can't report the ids of a multi-row INSERT
+            for obj in batch:
+                obj.save(force_insert=True)
+
+def log_actions(user, objects, action_flag, change_message, batch_size):
+    # change_message is a text, or a function returning the message of an object
+    if not objects:
+        return
+    content_type_id = ContentType.objects.get_for_model(objects[0]).pk
+    message = change_message if callable(change_message) else lambda obj: change_message
+    entries = [LogEntry(user_id=user.id,
+                        content_type_id=content_type_id,
+                        object_id=str(obj.pk),
+                        object_repr=str(obj)[:200],
+                        action_flag=action_flag,
+                        change_message=message(obj))
+               for obj in objects]
+    LogEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+def log_additions(user, objects, change_message, batch_size):
+    log_actions(user, objects, ADDITION, change_message, batch_size)
+
+### Primers
+
+PRIMER_COLUMNS = len(validation.PRIMER_COLUMNS)
+
+def check_primers(rows):
+    return check_primer_sheet(rows)
+
+def build_primers(rows, user, progress=None, batch_size=None):
+    # progress, if given, is called with the number of rows read so far after every batch_size rows
+    rows = read_rows(rows, progress, batch_size)
+    cleaned, report = check_primers(rows)
+    if report:
+        raise RowErrors(report)
+    fields = ['sequence', 'tm', 'template', 'location', 'restriction_sites', 'notes']
+    return [Primer(creator=user, **dict(zip(fields, values)))
+            for values in zip(*(cleaned[field].tolist() for field in fields))]
+
+def import_primers(rows, user, batch_size=None, progress=None):
+    batch_size = get_batch_size(batch_size)
+    primers = build_primers(rows, user, progress, batch_size)
+    with transaction.atomic():
+        bulk_insert(Primer, primers, batch_size)
+        if primers:
+            change_message = "Added via Excel file with primers " + format_id_ranges(primer.pk for primer in primers)
+            log_additions(user, primers, change_message, batch_size)
+    return primers
+
+### Chemicals
+
+CHEMICAL_COLUMNS = len(validation.CHEMICAL_COLUMNS)
+CHEMICAL_FIELDS = ['name', 'label', 'in_stock', 'msds', 'notes']
+
+def check_chemicals(rows):
+    return check_chemical_sheet(rows)
+
+def get_or_create_named(model, names, batch_size):
+    # Returns {lowercased name: pk} and the objects created. Names match regardless of case, and new objects are named
+    # as their first mention in the sheet is spelled.
+    wanted = {}
+    for name in names:
+        if name:
+            wanted.setdefault(name.lower(), name)
+    pks = {}
+    for name, pk in model.objects.annotate(lower_name=Lower('name')).filter(lower_name__in=wanted).order_by('pk').values_list('lower_name', 'pk'):
+        pks.setdefault(name, pk)
+    created = [model(name=name) for key, name in sorted(wanted.items()) if key not in pks]
+    bulk_insert(model, created, batch_size)
+    pks.update((obj.name.lower(), obj.pk) for obj in created)
+    return pks, created
+
+def allocate_codes(chemicals):
+    # One counter update per label rather than per chemical; call inside the transaction that inserts them
+    by_label = {}
+    for chemical in chemicals:
+        by_label.setdefault(chemical.label, []).append(chemical)
+    for label, group in sorted(by_label.items()):
+        for chemical, number in zip(group, ChemicalCounter.reserve(label, len(group))):
+            chemical.number = number
+            # bulk_create doesn't call save(), which normally sets the code
+            chemical.code = Chemical.make_code(label, number)
+
+def import_chemicals(rows, user, batch_size=None, progress=None):
+    batch_size = get_batch_size(batch_size)
+    rows = read_rows(rows, progress, batch_size)
+    cleaned, report = check_chemicals(rows)
+    if report:
+        raise RowErrors(report)
+    with transaction.atomic():
+        manufacturers, new_manufacturers = get_or_create_named(Manufacturer, cleaned['manufacturer'].tolist(), batch_size)
+        locations, new_locations = get_or_create_named(StorageLocation, cleaned['location'].tolist(), batch_size)
+        chemicals = []
+        for manufacturer, location, *values in zip(*(cleaned[field].tolist() for field in ['manufacturer', 'location'] + CHEMICAL_FIELDS)):
+            chemicals.append(Chemical(creator=user, manufacturer_id=manufacturers.get(manufacturer.lower()),
+                                      location_id=locations.get(location.lower()), **dict(zip(CHEMICAL_FIELDS, values))))
+        allocate_codes(chemicals)
+        bulk_insert(Chemical, chemicals, batch_size)
+        log_additions(user, new_manufacturers, "Added via Excel file of chemicals.", batch_size)
+        log_additions(user, new_locations, "Added via Excel file of chemicals.", batch_size)
+        if chemicals:
+            log_additions(user, chemicals, "Added via Excel file with chemicals " + format_codes(chemicals), batch_size)
+        # Their pages list their chemicals
+        manufacturer_pks = {chemical.manufacturer_id for chemical in chemicals}
+        location_pks = {chemical.location_id for chemical in chemicals}
+        transaction.on_commit(lambda: (invalidate_fragments(Manufacturer, manufacturer_pks),
+                                       invalidate_fragments(StorageLocation, location_pks)))
+    return chemicals
+
+### Libraries
+
+LIBRARY_COLUMNS = len(validation.LIBRARY_COLUMNS)
+LIBSTOCK_FIELDS = ['stock_id', 'plate', 'letter', 'number', 'species', 'gene_target', 'forward_primer_id', 'resistance', 'notes']
+
+def check_library(rows, first_row=2):
+    cleaned, report = check_library_sheet(rows, first_row)
+    check_primer_references(cleaned, report)
+    return cleaned, report
+
+def _check_sheets_in_processes(path, names, workers, progress):
+    # spawn rather than fork, since imports run in a thread of a process that holds database connections
+    results = [None] * len(names)
+    count = 0
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = {executor.submit(check_library_workbook_sheet, path, sheet): i for i, sheet in enumerate(names)}
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            if result is not None and progress is not None:
+                count += result[1].nrows
+                progress(count)
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return results
+
+def check_library_workbook(upload, progress=None, workers=None, parallel_min_size=None):
+    # Every visible sheet must have the columns of the template. Sheets of files on disk of at least parallel_min_size
+    # bytes are checked in worker processes.
+    path = upload.temporary_file_path() if hasattr(upload, 'temporary_file_path') else upload
+    names = sheet_names(upload)
+    workers = min(get_sheet_workers(workers), len(names))
+    parallel = isinstance(path, (str, os.PathLike)) and os.path.getsize(path) >= get_parallel_min_size(parallel_min_size)
+    if workers > 1 and parallel:
+        results = _check_sheets_in_processes(path, names, workers, progress)
+    else:
+        results = [check_library_workbook_sheet(upload, sheet) for sheet in names]
+    results = [result for result in results if result is not None]
+    cleaned, report = merge_library_sheets(results) if results else check_library_sheet([])
+    check_primer_references(cleaned, report)
+    if progress is not None:
+        progress(report.nrows)
+    return cleaned, report
+
+def libstocks_from_columns(cleaned, library=None):
+    stocks = []
+    for values in zip(*(cleaned[field].tolist() for field in LIBSTOCK_FIELDS)):
+        fields = dict(zip(LIBSTOCK_FIELDS, values))
+        fields['forward_primer_id'] = fields['forward_primer_id'] or None # 0 marks an empty cell
+        stocks.append(LibStock(library=library, **fields))
+    return stocks
+
+def build_libstocks(rows, progress=None, batch_size=None, first_row=2):
+    # first_row is the row number of the first row given, for resuming part way through a sheet
+    rows = read_rows(rows, progress, batch_size)
+    cleaned, report = check_library(rows, first_row)
+    if report:
+        raise RowErrors(report)
+    return libstocks_from_columns(cleaned)
+
+def build_workbook_libstocks(upload, progress=None, workers=None):
+    cleaned, report = check_library_workbook(upload, progress, workers)
+    if report:
+        raise RowErrors(report)
+    return libstocks_from_columns(cleaned)
+
+def add_library(name, user):
+    library = Library.objects.create(name=name)
+    log_additions(user, [library], "Added.", 1)
+    return library
+
+LibraryChanges = namedtuple('LibraryChanges', ['created', 'updated', 'deleted', 'unchanged'])
+
+def diff_libstocks(existing, uploaded):
+    # Stocks are matched by stock id, or failing that by well, so they keep their row (and plasmid map and bookmarks)
+    # when corrected or moved. Ids are matched for the whole sheet first, so a new stock only takes over the well of a
+    # stock that isn't in the sheet under its own id.
+    # Returns to_create, to_update, {pk: changed fields}, to_delete and the number unchanged.
+    by_stock_id = {}
+    by_well = {}
+    for stock in existing:
+        by_stock_id.setdefault(stock.stock_id, stock)
+        by_well.setdefault((stock.plate, stock.letter, stock.number), stock)
+
+    # Index of each uploaded stock -> the existing stock it updates
+    matches = {}
+    matched = set()
+    for i, new_stock in enumerate(uploaded):
+        old_stock = by_stock_id.get(new_stock.stock_id)
+        if old_stock is not None and old_stock.pk not in matched:
+            matches[i] = old_stock
+            matched.add(old_stock.pk)
+    for i, new_stock in enumerate(uploaded):
+        if i in matches:
+            continue
+        old_stock = by_well.get((new_stock.plate, new_stock.letter, new_stock.number))
+        if old_stock is not None and old_stock.pk not in matched:
+            matches[i] = old_stock
+            matched.add(old_stock.pk)
+
+    to_create = []
+    to_update = []
+    changes = {}
+    unchanged = 0
+    for i, new_stock in enumerate(uploaded):
+        old_stock = matches.get(i)
+        if old_stock is None:
+            to_create.append(new_stock)
+            continue
+        changed = [field for field in LIBSTOCK_FIELDS if getattr(old_stock, field) != getattr(new_stock, field)]
+        if changed:
+            for field in changed:
+                setattr(old_stock, field, getattr(new_stock, field))
+            to_update.append(old_stock)
+            changes[old_stock.pk] = changed
+        else:
+            unchanged += 1
+    to_delete = [stock for stock in existing if stock.pk not in matched]
+    return to_create, to_update, changes, to_delete, unchanged
+
+def _change_message(fields):
+    # Same format as the admin's own history entries
+    names = [str(LibStock._meta.get_field(field).verbose_name) for field in fields]
+    return json.dumps([{'changed': {'fields': names}}])
+
+def insert_library_stocks(library, stocks, user, start=0, checkpoint=None, batch_size=None):
+    # Commits every batch in its own transaction. start is the number committed by an earlier, interrupted run, and
+    # checkpoint is called inside each transaction with the total so far.
+    batch_size = get_batch_size(batch_size)
+    committed = start
+    for batch in batches(stocks, batch_size):
+        with transaction.atomic():
+            for new_stock in batch:
+                new_stock.library = library
+            bulk_insert(LibStock, batch, batch_size)
+            log_additions(user, batch, "Added.", batch_size)
+            committed += len(batch)
+            if checkpoint is not None:
+                checkpoint(committed)
+    return committed
+
+def apply_library_stocks(library, uploaded, user, remove_missing=True, batch_size=None):
+    # Writes only the stocks that differ, in a single transaction
+    batch_size = get_batch_size(batch_size)
+    for new_stock in uploaded:
+        new_stock.library = library
+    existing = list(library.libstock_set.all())
+    for stock in existing:
+        stock.library = library # saves a query per stock when the history entries are written
+    to_create, to_update, changes, to_delete, unchanged = diff_libstocks(existing, uploaded)
+    changed_fields = sorted(set(field for changed in changes.values() for field in changed))
+    if not remove_missing:
+        unchanged += len(to_delete)
+        to_delete = []
+
+    with transaction.atomic():
+        bulk_insert(LibStock, to_create, batch_size)
+        if to_update:
+            LibStock.objects.bulk_update(to_update, changed_fields, batch_size=batch_size)
+            # bulk_update doesn't send post_save
+            transaction.on_commit(lambda: invalidate_fragments(LibStock, [stock.pk for stock in to_update]))
+        for batch in batches(to_delete, batch_size):
+            LibStock.objects.filter(pk__in=[stock.pk for stock in batch]).delete()
+
+        log_actions(user, to_create, ADDITION, "Added via Excel file.", batch_size)
+        log_actions(user, to_update, CHANGE, lambda stock: _change_message(changes[stock.pk]), batch_size)
+        log_actions(user, to_delete, DELETION, "", batch_size)
+    return LibraryChanges(len(to_create), len(to_update), len(to_delete), unchanged)
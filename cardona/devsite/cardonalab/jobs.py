@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import ImportJob
+from .importers import (RowErrors, PRIMER_COLUMNS, LIBRARY_COLUMNS, CHEMICAL_COLUMNS, import_primers, import_chemicals, build_libstocks,
+                        build_workbook_libstocks, add_library, insert_library_stocks, apply_library_stocks, format_id_ranges)
+from .spreadsheets import SpreadsheetError, open_sheet, sheet_names
+
+logger = logging.getLogger(__name__)
+
+class JobError(Exception):
+    """Raised by an import when the uploaded file is unusable as a whole"""
+    pass
+
+### Running imports
+
+def _open_source(job, columns):
+    header, rows = open_sheet(job.source.path)
+    if len(header) != columns:
+        raise JobError('Incorrect number of columns in file "%s"' % os.path.basename(job.source.name))
+    return rows
+
+def _progress(job, offset=0):
+    def update(count):
+        # Bumping updated shows other workers that the job is still alive
+        ImportJob.objects.filter(pk=job.pk).update(rows_processed=offset + count, updated=timezone.now())
+        job.rows_processed = offset + count
+    return update
+
+def _checkpoint(job):
+    def update(count):
+        ImportJob.objects.filter(pk=job.pk).update(checkpoint=count, rows_processed=count, updated=timezone.now())
+        job.checkpoint = job.rows_processed = count
+    return update
+
+def _run_primers(job):
+    rows = _open_source(job, PRIMER_COLUMNS)
+    primers = import_primers(rows, job.creator, progress=_progress(job))
+    return "Successfully created %d primers from file (ids %s)" % (len(primers), format_id_ranges(primer.id for primer in primers))
+
+def _run_chemicals(job):
+    rows = _open_source(job, CHEMICAL_COLUMNS)
+    chemicals = import_chemicals(rows, job.creator, progress=_progress(job))
+    lines = ["Successfully created %d chemicals from file:" % len(chemicals)]
+    lines += ["%s: %s" % (chemical.code, chemical.name) for chemical in chemicals]
+    return "\n".join(lines)
+
+def _library_stocks(job, skip=0):
+    # The whole file is checked on every run, resumed or not, since wells are checked across rows and sheets; the first
+    # skip stocks, committed by an earlier run, are then left out
+    if len(sheet_names(job.source.path)) > 1:
+        # The sheets of a workbook are checked in parallel processes
+        stocks = build_workbook_libstocks(job.source.path, progress=_progress(job))
+    else:
+        stocks = build_libstocks(_open_source(job, LIBRARY_COLUMNS), progress=_progress(job))
+    return stocks[skip:]
+
+def _run_library(job):
+    # Stocks are committed batch by batch, with the number committed saved as the job's checkpoint, so that a job
+    # interrupted by a restart carries on from the checkpoint instead of starting over
+    if job.checkpoint and job.library is None:
+        raise JobError("The library being imported was deleted before the import finished")
+    try:
+        stocks = _library_stocks(job, skip=job.checkpoint)
+    except (JobError, RowErrors, SpreadsheetError, ValidationError):
+        # The file can't be imported, don't leave the stocks of an earlier run behind. Other errors leave the library
+        # and checkpoint for the runner to resume from.
+        if job.library is not None:
+            job.library.delete()
+            job.library = None
+        raise
+    if job.library is None:
+        with transaction.atomic():
+            job.library = add_library(job.library_name, job.creator)
+            ImportJob.objects.filter(pk=job.pk).update(library=job.library)
+    count = insert_library_stocks(job.library, stocks, job.creator, start=job.checkpoint, checkpoint=_checkpoint(job))
+    return "Successfully created library with %d stocks from file" % count
+
+def _run_library_update(job):
+    if job.library is None:
+        raise JobError("The library to update no longer exists")
+    changes = apply_library_stocks(job.library, _library_stocks(job), job.creator, remove_missing=job.remove_missing)
+    return "Updated library: %d stocks added, %d changed, %d removed, %d unchanged" % changes
+
+RUNNERS = {
+    ImportJob.PRIMERS: _run_primers,
+    ImportJob.LIBRARY: _run_library,
+    ImportJob.LIBRARY_UPDATE: _run_library_update,
+    ImportJob.CHEMICALS: _run_chemicals,
+}
+
+class _Heartbeat:
+    # Phases that report no progress, such as a library update's transaction, would otherwise look interrupted
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._beat, name='cardonalab-heartbeat-%d' % job_id, daemon=True)
+
+    def _beat(self):
+        try:
+            while not self.stopped.wait(ImportJob.stale_after() / 4):
+                try:
+                    ImportJob.objects.filter(pk=self.job_id, status=ImportJob.RUNNING).update(updated=timezone.now())
+                except DatabaseError:
+                    # Such as SQLite being locked by the import's own transaction; the next beat tries again
+                    logger.warning("Could not update the heartbeat of import job %d", self.job_id, exc_info=True)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def _can_resume(job):
+    # A new library's stocks are committed batch by batch and carried on from the checkpoint
+    return job.kind == ImportJob.LIBRARY and job.library is not None
+
+def run_job(job_id, resume=False):
+    # Returns False if the job was already taken by another worker. With resume, runs an interrupted job instead.
+    if resume:
+        jobs = ImportJob.objects.filter(pk=job_id, status=ImportJob.RUNNING, updated__lt=ImportJob.stale_before())
+        claimed = jobs.update(updated=timezone.now())
+    else:
+        jobs = ImportJob.objects.filter(pk=job_id, status=ImportJob.PENDING)
+        claimed = jobs.update(status=ImportJob.RUNNING, started=timezone.now(), updated=timezone.now())
+    if not claimed:
+        return False
+
+    job = ImportJob.objects.select_related('creator', 'library').get(pk=job_id)
+    try:
+        with _Heartbeat(job.pk):
+            job.result = RUNNERS[job.kind](job)
+        job.status = ImportJob.DONE
+    except SpreadsheetError as e:
+        job.errors = 'Failed to read file "%s": %s' % (os.path.basename(job.source.name), e)
+        job.status = ImportJob.FAILED
+    except RowErrors as e:
+        job.errors = e.describe()
+        job.status = ImportJob.FAILED
+    except JobError as e:
+        job.errors = str(e)
+        job.status = ImportJob.FAILED
+    except Exception:
+        logger.exception("Import job %d crashed", job.pk)
+        if _can_resume(job):
+            # Left running, the job is resumed by the next sweep once it goes stale
+            return True
+        job.errors = traceback.format_exc()
+        job.status = ImportJob.FAILED
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'result', 'errors', 'library', 'rows_processed', 'finished', 'updated'])
+    # The upload is only needed until the job finishes; its name is kept for the job page
+    job.source.storage.delete(job.source.name)
+    return True
+
+def run_pending_jobs():
+    # Resumes interrupted jobs, then runs every pending job, oldest first. Returns how many jobs were run.
+    count = 0
+    interrupted = ImportJob.objects.filter(status=ImportJob.RUNNING, updated__lt=ImportJob.stale_before())
+    for job_id in interrupted.order_by('created').values_list('pk', flat=True):
+        if run_job(job_id, resume=True):
+            count += 1
+    for job_id in ImportJob.objects.filter(status=ImportJob.PENDING).order_by('created').values_list('pk', flat=True):
+        if run_job(job_id):
+            count += 1
+    return count
+
+### In-process worker pool
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'CARDONALAB_IMPORT_WORKERS', 1),
+                                           thread_name_prefix='cardonalab-import')
+        return _executor
+
+def _run_in_thread():
+    close_old_connections()
+    try:
+        run_pending_jobs()
+    except Exception:
+        logger.exception("Import jobs could not be run")
+    finally:
+        close_old_connections()
+
+def _runs_in_threads():
+    return getattr(settings, 'CARDONALAB_IMPORT_RUNNER', 'thread') == 'thread'
+
+def start_job(job):
+    # With the 'thread' runner pending and interrupted jobs run once the transaction commits, otherwise they are left
+    # for the run_import_jobs command
+    if _runs_in_threads():
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread))
+
+def start_runner():
+    """Runs the jobs left pending or interrupted by the last restart, see CARDONALAB_IMPORT_START_RUNNER"""
+    if _runs_in_threads():
+        _get_executor().submit(_run_in_thread)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from cardonalab.bookmarks import delete_dangling_bookmarks
+
+class Command(BaseCommand):
+    help = "Deletes the bookmarks of objects that no longer exist, such as ones deleted directly in the database."
+
+    def handle(self, *args, **options):
+        count = delete_dangling_bookmarks()
+        self.stdout.write("Deleted %d bookmark(s)" % count)
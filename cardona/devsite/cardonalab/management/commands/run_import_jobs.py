@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cardonalab.jobs import run_pending_jobs
+
+class Command(BaseCommand):
+    help = "Runs pending spreadsheet import jobs. Use with CARDONALAB_IMPORT_RUNNER = 'command' to keep imports out of the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new jobs instead of exiting when none are left")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to wait between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write("Ran %d import job(s)" % count)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
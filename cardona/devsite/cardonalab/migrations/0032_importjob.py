@@ -0,0 +1,43 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:58
+
+import cardonalab.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cardonalab', '0031_rename_librarybulkdataload_crisprilibrary_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='crisprilibrary',
+            options={'verbose_name_plural': 'Crispri Library'},
+        ),
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('kind', models.CharField(choices=[('primers', 'Primers'), ('library', 'Library')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('source', models.FileField(upload_to=cardonalab.models._import_upload_location)),
+                ('library_name', models.CharField(blank=True, max_length=255)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('result', models.TextField(blank=True)),
+                ('errors', models.TextField(blank=True)),
+                ('creator', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('library', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cardonalab.library')),
+            ],
+            options={
+                'verbose_name_plural': 'Import Jobs',
+            },
+        ),
+    ]
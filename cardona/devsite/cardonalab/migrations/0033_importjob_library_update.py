@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0032_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='remove_missing',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='kind',
+            field=models.CharField(choices=[('primers', 'Primers'), ('library', 'Library'), ('library_update', 'Library update')], max_length=20),
+        ),
+    ]
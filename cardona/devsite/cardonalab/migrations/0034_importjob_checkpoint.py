@@ -0,0 +1,24 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:20
+
+import cardonalab.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0033_importjob_library_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='checkpoint',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='source',
+            field=models.FileField(storage=cardonalab.models._import_spool_storage, upload_to=cardonalab.models._import_upload_location),
+        ),
+    ]
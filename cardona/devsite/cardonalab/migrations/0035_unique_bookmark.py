@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:40
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_bookmarks(apps, schema_editor):
+    # Keep the oldest bookmark of each (user, object) so the unique constraint can be added
+    Bookmark = apps.get_model('cardonalab', 'Bookmark')
+    duplicates = (Bookmark.objects.values('user', 'content_type', 'object_id')
+                  .annotate(first=Min('id'), count=models.Count('id')).filter(count__gt=1))
+    for duplicate in duplicates:
+        (Bookmark.objects.filter(user=duplicate['user'], content_type=duplicate['content_type'], object_id=duplicate['object_id'])
+         .exclude(id=duplicate['first']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0034_importjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_bookmarks, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookmark',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='unique_bookmark'),
+        ),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+TRUE_VALUES = {'y', 'yes', 'true', '1'}
+FALSE_VALUES = {'n', 'no', 'false', '0'}
+
+FACET_FIELDS = ['boxNo', 'plate', 'species', 'resistance', 'essential', 'growthDefect']
+
+def to_number(value):
+    # Sheets imported through Excel stored numbers as "2.0"
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() and 0 <= number <= 32767 else None
+
+def to_flag(value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return None
+
+def convert_columns(apps, schema_editor):
+    CrispriLibrary = apps.get_model('cardonalab', 'CrispriLibrary')
+    batch = []
+    for row in CrispriLibrary.objects.order_by('pk').iterator(chunk_size=2000):
+        row.plate_number = to_number(row.plate)
+        row.well_number = to_number(row.wellNo)
+        row.essential_flag = to_flag(row.essential)
+        row.growth_defect_flag = to_flag(row.growthDefect)
+        batch.append(row)
+        if len(batch) == 2000:
+            CrispriLibrary.objects.bulk_update(batch, ['plate_number', 'well_number', 'essential_flag', 'growth_defect_flag'])
+            batch = []
+    CrispriLibrary.objects.bulk_update(batch, ['plate_number', 'well_number', 'essential_flag', 'growth_defect_flag'])
+
+def count_facets(apps, schema_editor):
+    CrispriLibrary = apps.get_model('cardonalab', 'CrispriLibrary')
+    CrispriFacet = apps.get_model('cardonalab', 'CrispriFacet')
+    facets = []
+    for field in FACET_FIELDS:
+        for value, count in CrispriLibrary.objects.order_by().values_list(field).annotate(count=Count('pk')):
+            facets.append(CrispriFacet(field=field, value='' if value is None else str(value), count=count))
+    CrispriFacet.objects.bulk_create(facets)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0035_unique_bookmark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crisprilibrary',
+            name='plate_number',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='crisprilibrary',
+            name='well_number',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='crisprilibrary',
+            name='essential_flag',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.AddField(
+            model_name='crisprilibrary',
+            name='growth_defect_flag',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.RunPython(convert_columns, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='crisprilibrary',
+            name='plate',
+        ),
+        migrations.RemoveField(
+            model_name='crisprilibrary',
+            name='wellNo',
+        ),
+        migrations.RemoveField(
+            model_name='crisprilibrary',
+            name='essential',
+        ),
+        migrations.RemoveField(
+            model_name='crisprilibrary',
+            name='growthDefect',
+        ),
+        migrations.RenameField(
+            model_name='crisprilibrary',
+            old_name='plate_number',
+            new_name='plate',
+        ),
+        migrations.RenameField(
+            model_name='crisprilibrary',
+            old_name='well_number',
+            new_name='wellNo',
+        ),
+        migrations.RenameField(
+            model_name='crisprilibrary',
+            old_name='essential_flag',
+            new_name='essential',
+        ),
+        migrations.RenameField(
+            model_name='crisprilibrary',
+            old_name='growth_defect_flag',
+            new_name='growthDefect',
+        ),
+        migrations.AddIndex(
+            model_name='crisprilibrary',
+            index=models.Index(fields=['plate', 'wellLetter', 'wellNo'], name='crispri_plate_well_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crisprilibrary',
+            index=models.Index(fields=['boxNo', 'plate', 'wellLetter', 'wellNo'], name='crispri_box_well_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crisprilibrary',
+            index=models.Index(fields=['locusTag'], name='crispri_locus_tag_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crisprilibrary',
+            index=models.Index(fields=['downStreamGene'], name='crispri_gene_idx'),
+        ),
+        migrations.CreateModel(
+            name='CrispriFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=255)),
+                ('value', models.CharField(blank=True, max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='crisprifacet',
+            constraint=models.UniqueConstraint(fields=('field', 'value'), name='unique_crispri_facet'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import CharField
+from django.db.models.functions import Cast, Concat
+
+def fill_codes(apps, schema_editor):
+    Chemical = apps.get_model('cardonalab', 'Chemical')
+    Chemical.objects.update(code=Concat('label', Cast('number', CharField()), output_field=CharField()))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0036_typed_crisprilibrary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chemical',
+            name='code',
+            field=models.CharField(editable=False, max_length=16, null=True),
+        ),
+        migrations.RunPython(fill_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chemical',
+            name='code',
+            field=models.CharField(editable=False, max_length=16, unique=True),
+        ),
+    ]
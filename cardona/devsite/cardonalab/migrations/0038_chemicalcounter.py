@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:10
+
+from django.db import migrations, models
+from django.db.models import Max
+
+def seed_counters(apps, schema_editor):
+    Chemical = apps.get_model('cardonalab', 'Chemical')
+    ChemicalCounter = apps.get_model('cardonalab', 'ChemicalCounter')
+    last_numbers = Chemical.objects.order_by().values_list('label').annotate(last=Max('number'))
+    ChemicalCounter.objects.bulk_create([ChemicalCounter(label=label, last_number=last) for label, last in last_numbers])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0037_chemical_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChemicalCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=1, unique=True)),
+                ('last_number', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cardonalab', '0038_chemicalcounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='kind',
+            field=models.CharField(choices=[('primers', 'Primers'), ('library', 'Library'), ('library_update', 'Library update'), ('chemicals', 'Chemicals')], max_length=20),
+        ),
+    ]
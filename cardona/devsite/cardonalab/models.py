@@ -1,12 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+import datetime
 import re
 
 ### Generic Relations
@@ -30,6 +35,9 @@ class Bookmark(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='unique_bookmark')]
+
 ### Base class for models that record creator info
 
 class BaseModel(models.Model):
@@ -45,6 +53,7 @@ class BaseModel(models.Model):
 
 class Manufacturer(models.Model):
     name = models.CharField(max_length=255)
+    bookmarks = GenericRelation(Bookmark)
     def __str__(self):
         return self.name
 
@@ -53,6 +62,7 @@ class Manufacturer(models.Model):
 
 class StorageLocation(models.Model):
     name = models.CharField(max_length=255)
+    bookmarks = GenericRelation(Bookmark)
     def __str__(self):
         return self.name
     
@@ -63,15 +73,18 @@ class Chemical(BaseModel):
     name = models.CharField(max_length=255)
     label = models.CharField(max_length=1)
     number = models.IntegerField(editable=False)
+    # label and number, stored so that a code can be looked up through an index
+    code = models.CharField(max_length=16, unique=True, editable=False)
     manufacturer = models.ForeignKey(Manufacturer, models.SET_NULL, null=True)
     location = models.ForeignKey(StorageLocation, models.SET_NULL, null=True)
     in_stock = models.BooleanField(default=True)
     msds = models.URLField('Link to MSDS', blank=True)
     notes = models.TextField("Additional Notes", blank=True)
+    bookmarks = GenericRelation(Bookmark)
 
-    def code(self):
-        return self.label + str(self.number)
-    code.admin_order_field = models.functions.Concat('label', 'number')
+    @staticmethod
+    def make_code(label, number):
+        return "%s%d" % (label, number)
 
     def __str__(self):
         return self.name
@@ -80,19 +93,69 @@ class Chemical(BaseModel):
         if not str(self.label).isupper():
             raise ValidationError("Label must be a single uppercase letter")
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        chemical = super().from_db(db, field_names, values)
+        # Remembered so that save() can tell whether the code changed without reading the row again
+        chemical._loaded_label = chemical.__dict__.get('label')
+        chemical._loaded_number = chemical.__dict__.get('number')
+        return chemical
+
+    def _label_changed(self):
+        loaded = self.__dict__.get('_loaded_label')
+        if loaded is None:
+            loaded = Chemical.objects.filter(pk=self.pk).values_list('label', flat=True).first()
+        return self.label != loaded
+
     def save(self, *args, **kwargs):
-        if self.number is None or self.label != Chemical.objects.get(pk=self.pk).label:
-            query = Chemical.objects.filter(label__exact=self.label).order_by('-number')
-            if query:
-                self.number = query[0].number + 1
-            else:
-                self.number = 1
-        super().save(*args, **kwargs)
+        # A new number is taken from the label's counter in the same transaction as the save, so concurrent saves never
+        # get the same code
+        with transaction.atomic():
+            if self.number is None or (not self._state.adding and self._label_changed()):
+                self.number = ChemicalCounter.reserve(self.label)[0]
+            elif self._state.adding or self.number != self.__dict__.get('_loaded_number'):
+                # A number set by hand, e.g. from a fixture, must never be given out again
+                ChemicalCounter.claim(self.label, self.number)
+            self.code = self.make_code(self.label, self.number)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'number', 'code'}
+            super().save(*args, **kwargs)
+        self._loaded_label = self.label
+        self._loaded_number = self.number
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=['label', 'number'], name='unique_code')]
         verbose_name_plural = "          Chemicals"
 
+class ChemicalCounter(models.Model):
+    """The last chemical number given out for each label"""
+    label = models.CharField(max_length=1, unique=True)
+    last_number = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "%s%d" % (self.label, self.last_number)
+
+    @classmethod
+    def reserve(cls, label, count=1):
+        # The counter row stays locked until the transaction ends, so call this inside the one saving the chemicals
+        with transaction.atomic():
+            if not cls.objects.filter(label=label).update(last_number=F('last_number') + count):
+                # First use of the label: start after any numbers already in use
+                start = Chemical.objects.filter(label=label).aggregate(last=Max('number'))['last'] or 0
+                cls.objects.get_or_create(label=label, defaults={'last_number': start})
+                cls.objects.filter(label=label).update(last_number=F('last_number') + count)
+            last = cls.objects.filter(label=label).values_list('last_number', flat=True).get()
+        return range(last - count + 1, last + 1)
+
+    @classmethod
+    def claim(cls, label, number):
+        """Moves the counter of label up to number if it is behind, for chemicals saved with a number of their own"""
+        with transaction.atomic():
+            if not cls.objects.filter(label=label).update(last_number=Greatest('last_number', number)):
+                start = Chemical.objects.filter(label=label).aggregate(last=Max('number'))['last'] or 0
+                cls.objects.get_or_create(label=label, defaults={'last_number': max(start, number)})
+                cls.objects.filter(label=label).update(last_number=Greatest('last_number', number))
+
 class Primer(BaseModel):
     sequence = models.CharField(max_length=255)
     tm = models.FloatField()
@@ -100,6 +163,7 @@ class Primer(BaseModel):
     location = models.CharField(max_length=255, blank=True)
     restriction_sites = models.CharField(max_length=255, blank=True)
     notes = models.TextField(blank=True)
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return str(self.pk)
@@ -118,6 +182,7 @@ class Plasmid(BaseModel):
     notes = models.TextField(blank=True)
     primers = models.ManyToManyField(Primer, blank=True)
     files = GenericRelation(File)
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return self.name
@@ -132,6 +197,7 @@ class Strain(BaseModel):
     resistance = models.CharField(max_length=255, blank=True)
     notes = models.TextField(blank=True)
     files = GenericRelation(File)
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return self.name
@@ -143,6 +209,7 @@ class Stock(BaseModel):
     strain = models.ForeignKey(Strain, models.SET_NULL, null=True)
     plasmid = models.ForeignKey(Plasmid, models.SET_NULL, null=True, blank=True)
     notes = models.TextField(blank=True)
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return str(self.pk)
@@ -152,6 +219,7 @@ class Stock(BaseModel):
 
 class Tag(models.Model):
     name = models.SlugField()
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return self.name
@@ -164,6 +232,7 @@ class Protocol(BaseModel):
     tags = models.ManyToManyField(Tag, blank=True)
     body = models.TextField()
     files = GenericRelation(File)
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return self.title
@@ -197,6 +266,7 @@ class LibStock(models.Model):
     forward_primer = models.ForeignKey(Primer, models.SET_NULL, null=True, blank=True)
     resistance = models.CharField(max_length=255, blank=True)
     notes = models.TextField(blank=True)
+    bookmarks = GenericRelation(Bookmark)
 
     def location(self):
         return "Plate %d, well %c%d" % (self.plate, self.letter, self.number)
@@ -209,6 +279,7 @@ class Genome(BaseModel):
     title = models.CharField(max_length=255)
     body = models.TextField()
     files = GenericRelation(File)
+    bookmarks = GenericRelation(Bookmark)
 
     def __str__(self):
         return self.title
@@ -218,17 +289,103 @@ class Genome(BaseModel):
 
 class CrispriLibrary(models.Model):
     boxNo = models.CharField(max_length=255)
-    plate = models.CharField(max_length=255)
+    # Rows that were imported before plates and wells were stored as numbers may have none
+    plate = models.PositiveSmallIntegerField(null=True)
     wellLetter = models.CharField(max_length=255)
-    wellNo = models.CharField(max_length=255)
+    wellNo = models.PositiveSmallIntegerField(null=True)
     locusTag = models.CharField(max_length=255)
     downStreamGene = models.CharField(max_length=255)
     forwardPrimer = models.CharField(max_length=255)
     species = models.CharField(max_length=255)
     resistance = models.CharField(max_length=255)
-    essential = models.CharField(max_length=255)
-    growthDefect = models.CharField(max_length=255)
+    essential = models.BooleanField(null=True)
+    growthDefect = models.BooleanField(null=True)
     notes = models.CharField(max_length=255)
 
     class Meta:
-        verbose_name_plural = "Crispri Library"
\ No newline at end of file
+        verbose_name_plural = "Crispri Library"
+        indexes = [
+            # plate order listings
+            models.Index(fields=['plate', 'wellLetter', 'wellNo'], name='crispri_plate_well_idx'),
+            # rows are matched to existing ones by box and well on import
+            models.Index(fields=['boxNo', 'plate', 'wellLetter', 'wellNo'], name='crispri_box_well_idx'),
+            models.Index(fields=['locusTag'], name='crispri_locus_tag_idx'),
+            models.Index(fields=['downStreamGene'], name='crispri_gene_idx'),
+        ]
+
+class CrispriFacet(models.Model):
+    # Rows per value of each filterable column, so the changelist filters don't scan the library (see facets.py)
+    field = models.CharField(max_length=255)
+    value = models.CharField(max_length=255, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "%s = %s" % (self.field, self.value)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['field', 'value'], name='unique_crispri_facet')]
+
+def _import_upload_location(instance, filename):
+    return 'imports/%s' % filename
+
+def _import_spool_storage():
+    # Uploads wait here, outside the served media directory, until their import job finishes
+    return FileSystemStorage(location=getattr(settings, 'CARDONALAB_IMPORT_SPOOL_DIR', settings.MEDIA_ROOT))
+
+class ImportJob(BaseModel):
+    PRIMERS = 'primers'
+    LIBRARY = 'library'
+    LIBRARY_UPDATE = 'library_update'
+    CHEMICALS = 'chemicals'
+    KIND_CHOICES = [(PRIMERS, 'Primers'), (LIBRARY, 'Library'), (LIBRARY_UPDATE, 'Library update'), (CHEMICALS, 'Chemicals')]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    source = models.FileField(upload_to=_import_upload_location, storage=_import_spool_storage)
+    library_name = models.CharField(max_length=255, blank=True)
+    library = models.ForeignKey(Library, models.SET_NULL, null=True, blank=True)
+    remove_missing = models.BooleanField(default=False)
+
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    checkpoint = models.PositiveIntegerField(default=0) # rows committed so far by imports that commit in batches
+    result = models.TextField(blank=True)
+    errors = models.TextField(blank=True)
+
+    def is_finished(self):
+        return self.status in (ImportJob.DONE, ImportJob.FAILED)
+
+    def is_interrupted(self):
+        """True for a running job that hasn't reported progress for CARDONALAB_IMPORT_STALE_AFTER seconds"""
+        return self.status == ImportJob.RUNNING and self.updated < ImportJob.stale_before()
+
+    @staticmethod
+    def stale_after():
+        return getattr(settings, 'CARDONALAB_IMPORT_STALE_AFTER', 300)
+
+    @staticmethod
+    def stale_before():
+        return timezone.now() - datetime.timedelta(seconds=ImportJob.stale_after())
+
+    def elapsed(self):
+        """Seconds spent running so far, or in total once finished"""
+        if self.started is None:
+            return 0
+        return ((self.finished or timezone.now()) - self.started).total_seconds()
+
+    def rows_per_second(self):
+        elapsed = self.elapsed()
+        return self.rows_processed / elapsed if elapsed else 0
+
+    def __str__(self):
+        return "%s import #%d" % (self.get_kind_display(), self.pk)
+
+    class Meta:
+        verbose_name_plural = "Import Jobs"
@@ -0,0 +1,139 @@
+import hashlib
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from django.utils.http import urlencode
+
+# Query string parameters holding the ordering values of the row a page starts after or ends before
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+def get_count_timeout():
+    return getattr(settings, 'CARDONALAB_COUNT_TIMEOUT', 300)
+
+class KeysetChangeList(ChangeList):
+    # Pages by the values of the ordering columns instead of OFFSET, falling back to the usual pages for orderings
+    # such as expressions. Not for list_editable, since result_list is a list rather than a queryset.
+    keyset = False
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Sorting, filtering and searching start again from the first page
+        return super().get_query_string(new_params, [AFTER_VAR, BEFORE_VAR] + list(remove or []))
+
+    def _keyset_fields(self, request):
+        """Returns [(field, descending)] for the ordering, or None if it isn't made of columns"""
+        fields, names = [], set()
+        for item in self.get_ordering(request, self.queryset):
+            if not isinstance(item, str):
+                return None
+            name = item.lstrip('-')
+            try:
+                field = self.lookup_opts.pk if name == 'pk' else self.lookup_opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            # Only the first mention of a column counts in the ordering
+            if field.name in names:
+                continue
+            names.add(field.name)
+            # Foreign keys sort by the related model's ordering, so only those without one compare by id
+            if not field.concrete or (field.is_relation and field.related_model._meta.ordering):
+                return None
+            fields.append((field, item.startswith('-')))
+        return fields
+
+    def _decode_cursor(self, fields, cursor):
+        try:
+            values = json.loads(cursor)
+            if len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for (field, _), value in zip(fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise IncorrectLookupParameters
+
+    def _cursor(self, fields, obj):
+        # str keeps the microseconds of times, which DjangoJSONEncoder rounds off
+        return json.dumps([getattr(obj, field.attname) for field, _ in fields], default=str)
+
+    # NULL is ordered as the greatest value, whatever the database does by default
+    @staticmethod
+    def _ordering(fields):
+        return [F(field.attname).desc(nulls_first=True) if descending else F(field.attname).asc(nulls_last=True)
+                for field, descending in fields]
+
+    @staticmethod
+    def _compare(name, lookup, value):
+        if lookup == 'exact':
+            return Q(**{name + '__isnull': True}) if value is None else Q(**{name: value})
+        if lookup == 'gt':
+            return Q(pk__in=[]) if value is None else Q(**{name + '__gt': value}) | Q(**{name + '__isnull': True})
+        return Q(**{name + '__isnull': False}) if value is None else Q(**{name + '__lt': value})
+
+    def _beyond(self, fields, values, backwards=False):
+        """The rows after values in the ordering, or before them with backwards"""
+        conditions, equal = [], Q()
+        for (field, descending), value in zip(fields, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            conditions.append(equal & self._compare(field.attname, lookup, value))
+            equal &= self._compare(field.attname, 'exact', value)
+        return reduce(or_, conditions)
+
+    def get_results(self, request):
+        fields = self._keyset_fields(request)
+        if fields is None:
+            return super().get_results(request)
+        after, before = self.params.pop(AFTER_VAR, None), self.params.pop(BEFORE_VAR, None)
+
+        queryset = self.queryset.order_by(*self._ordering(fields))
+        if before is not None:
+            queryset = queryset.filter(self._beyond(fields, self._decode_cursor(fields, before), backwards=True)).reverse()
+        elif after is not None:
+            queryset = queryset.filter(self._beyond(fields, self._decode_cursor(fields, after)))
+        # One extra row tells whether there is another page
+        rows = list(queryset[:self.list_per_page + 1])
+        more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if before is not None:
+            rows.reverse()
+        has_previous = more if before is not None else after is not None
+        has_next = more if before is None else True
+
+        self.keyset = True
+        self.previous_url = self.get_query_string({BEFORE_VAR: self._cursor(fields, rows[0])}) if has_previous and rows else None
+        self.next_url = self.get_query_string({AFTER_VAR: self._cursor(fields, rows[-1])}) if has_next and rows else None
+        self.result_count = self.model_admin.estimate_count(request, self.queryset, self.params)
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.full_result_count = self.model_admin.estimate_count(request, self.root_queryset, {}) if self.show_full_result_count else None
+        self.show_admin_actions = bool(rows) or has_previous
+        self.result_list = rows
+        # The page links and "Show all" of the usual pagination don't apply
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = None
+
+class KeysetPaginationMixin:
+    """Lets a ModelAdmin opt into KeysetChangeList with keyset_pagination = True"""
+    keyset_pagination = False
+
+    def get_changelist(self, request, **kwargs):
+        if self.keyset_pagination:
+            return KeysetChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def estimate_count(self, request, queryset, params):
+        # Cached for CARDONALAB_COUNT_TIMEOUT seconds, so it can be slightly out of date
+        params = sorted((key, value) for key, value in params.items() if key != ORDER_VAR)
+        key = 'cardonalab:count:%s:%s' % (self.model._meta.label_lower, hashlib.md5(urlencode(params).encode()).hexdigest())
+        return cache.get_or_set(key, queryset.count, get_count_timeout())
@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+import numpy as np
+
+from .validation import WELL_LETTERS
+
+# (rows, columns) of the plate formats, smallest first
+PLATE_FORMATS = [(8, 12), (16, 24)]
+
+WellStock = namedtuple('WellStock', ['id', 'stock_id', 'gene_target'])
+
+class PlateMap:
+    # A list of stocks per well, as stocks may share a well when entered by hand. Stocks that don't fit go in unplaced.
+    def __init__(self, stocks):
+        stocks = list(stocks)
+        rows = np.array([_row_index(letter) for _, _, _, letter, _ in stocks], dtype=int)
+        columns = np.array([number - 1 for _, _, _, _, number in stocks], dtype=int)
+        # Wells that don't fit the largest plate don't decide the plate's format
+        largest = PLATE_FORMATS[-1]
+        placed = (rows >= 0) & (columns >= 0) & (rows < largest[0]) & (columns < largest[1])
+        self.shape = plate_format(rows[placed], columns[placed])
+        placed &= (rows < self.shape[0]) & (columns < self.shape[1])
+
+        self.counts = np.zeros(self.shape, dtype=int)
+        np.add.at(self.counts, (rows[placed], columns[placed]), 1)
+        self.wells = np.empty(self.shape, dtype=object)
+        for index in np.ndindex(self.shape):
+            self.wells[index] = []
+        self.unplaced = []
+        for stock, row, column, ok in zip(stocks, rows, columns, placed):
+            stock = WellStock(*stock[:3])
+            if ok:
+                self.wells[row, column].append(stock)
+            else:
+                self.unplaced.append(stock)
+
+    @property
+    def letters(self):
+        return WELL_LETTERS[:self.shape[0]]
+
+    @property
+    def numbers(self):
+        return range(1, self.shape[1] + 1)
+
+    @property
+    def size(self):
+        return self.counts.size
+
+    @property
+    def filled(self):
+        return int(np.count_nonzero(self.counts))
+
+    @property
+    def shared(self):
+        """Number of wells holding more than one stock"""
+        return int(np.count_nonzero(self.counts > 1))
+
+    def rows(self):
+        """Yields (letter, wells of the row) for the template"""
+        for letter, wells in zip(self.letters, self.wells):
+            yield letter, list(wells)
+
+def _row_index(letter):
+    letter = letter.upper()
+    return WELL_LETTERS.index(letter) if len(letter) == 1 and letter in WELL_LETTERS else -1
+
+def plate_format(rows, columns):
+    """Returns the (rows, columns) of the smallest plate format holding every well, given zero-based well indices"""
+    for shape in PLATE_FORMATS:
+        if not len(rows) or (rows.max() < shape[0] and columns.max() < shape[1]):
+            return shape
+    return PLATE_FORMATS[-1]
+
+def get_plate_map(library, plate):
+    """Loads one plate of a library with a single query"""
+    stocks = library.libstock_set.filter(plate=plate).order_by('stock_id').values_list('id', 'stock_id', 'gene_target', 'letter', 'number')
+    return PlateMap(stocks)
@@ -1,8 +1,96 @@
-from import_export import resources
-from .models import LibraryBulkDataLoad
+import copy
+import io
+
+import tablib
+from import_export import fields, resources, widgets
+from import_export.formats import base_formats
+from import_export.instance_loaders import ModelInstanceLoader
+
+from .models import CrispriLibrary
+from .importers import get_batch_size
+from .facets import refresh_facets
+from .spreadsheets import iter_rows
+
+class NaturalKeyInstanceLoader(ModelInstanceLoader):
+    # Reads the keys of every existing object in one query instead of one per row. Matched rows get a bare instance,
+    # which is enough for skip_diff imports since every field is overwritten from the row.
+    def __init__(self, resource, dataset=None):
+        super().__init__(resource, dataset)
+        self.fields = [resource.fields[name] for name in resource.get_import_id_fields()]
+        self.attributes = [field.attribute for field in self.fields]
+        self.pks = {}
+        for values in self.get_queryset().values_list(*self.attributes, 'pk').iterator(chunk_size=resource.get_chunk_size()):
+            self.pks[self._key(values[:-1])] = values[-1]
+
+    @staticmethod
+    def _key(values):
+        # Sheets may give numbers where the database has text, so compare everything as text
+        return tuple(str(value) for value in values)
+
+    def get_instance(self, row):
+        values = [field.clean(row) for field in self.fields]
+        pk = self.pks.get(self._key(values))
+        if pk is None:
+            return None
+        return self.resource._meta.model(pk=pk, **dict(zip(self.attributes, values)))
+
+class FlagWidget(widgets.BooleanWidget):
+    # The library sheets use Y/N
+    TRUE_VALUES = ['Y', 'y', 'Yes', 'yes', 'YES'] + widgets.BooleanWidget.TRUE_VALUES
+    FALSE_VALUES = ['N', 'n', 'No', 'no', 'NO'] + widgets.BooleanWidget.FALSE_VALUES
+
+    def render(self, value, obj=None, **kwargs):
+        if self.coerce_to_string and isinstance(value, bool) and not kwargs.get('force_native_type'):
+            return 'Y' if value else 'N'
+        return super().render(value, **kwargs)
+
+class CrispriLibraryResource(resources.ModelResource):
+    essential = fields.Field(attribute='essential', column_name='essential', widget=FlagWidget())
+    growthDefect = fields.Field(attribute='growthDefect', column_name='growthDefect', widget=FlagWidget())
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # The batch size is read when an import runs rather than when the module is imported
+        self._meta = copy.copy(self._meta)
+        self._meta.batch_size = get_batch_size()
+
+    def get_chunk_size(self):
+        return get_batch_size()
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        if not kwargs.get('dry_run'):
+            refresh_facets()
 
-class LibraryBulkDataLoadResource(resources.ModelResource):
     class Meta:
-        model = LibraryBulkDataLoad
+        model = CrispriLibrary
         exclude = ('id', )
-        skip_unchanged = False
\ No newline at end of file
+        import_id_fields = ('boxNo', 'plate', 'wellLetter', 'wellNo')
+        instance_loader_class = NaturalKeyInstanceLoader
+        use_bulk = True
+        skip_unchanged = False
+        skip_diff = True
+
+class _ReaderFormat:
+    # Makes an import-export format build its dataset with the app's own spreadsheet reader
+    def create_dataset(self, in_stream, **kwargs):
+        if isinstance(in_stream, str):
+            in_stream = io.StringIO(in_stream, newline='')
+        elif isinstance(in_stream, bytes):
+            in_stream = io.BytesIO(in_stream)
+        rows = iter_rows(in_stream, "upload." + self.get_extension())
+        dataset = tablib.Dataset(headers=next(rows, []))
+        for row in rows:
+            dataset.append((row + [''] * dataset.width)[:dataset.width])
+        return dataset
+
+class XLSXFormat(_ReaderFormat, base_formats.XLSX):
+    pass
+
+class CSVFormat(_ReaderFormat, base_formats.CSV):
+    pass
+
+class TSVFormat(_ReaderFormat, base_formats.TSV):
+    pass
+
+IMPORT_FORMATS = [XLSXFormat, CSVFormat, TSVFormat]
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Bookmark, CrispriLibrary, Chemical, Manufacturer, StorageLocation, Primer, Plasmid, Strain, Stock, Tag, Protocol, LibStock, Genome
+from .bookmarks import forget_bookmarks
+from .facets import facet_values, update_facets
+from .fragments import FRAGMENT_DEPENDENCIES, dependent_fragments, invalidate_fragments, invalidate_dependent_fragments
+
+# Bookmarks of deleted objects are deleted along with them through each model's bookmarks GenericRelation, which sends
+# post_delete for every bookmark, so this also covers deleted objects
+@receiver([post_save, post_delete], sender=Bookmark)
+def bookmark_changed(sender, instance, **kwargs):
+    forget_bookmarks(instance.user_id)
+
+### Detail page fragments
+
+# Models with cached detail page fragments
+DETAIL_MODELS = [Chemical, Manufacturer, StorageLocation, Primer, Plasmid, Strain, Stock, Tag, Protocol, LibStock, Genome]
+
+# Fragments are only cleared once the change is committed, so that a page rendered in the meantime from the old rows
+# can't be cached under the new version
+
+def object_saving(sender, instance, raw=False, **kwargs):
+    # Pages showing the object before a foreign key changed need clearing as well as those showing it afterwards
+    if not raw and not instance._state.adding:
+        instance._fragment_dependents = dependent_fragments(instance)
+
+def object_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    dependents = getattr(instance, '_fragment_dependents', []) + dependent_fragments(instance)
+    instance._fragment_dependents = []
+    def invalidate():
+        invalidate_fragments(sender, [instance.pk])
+        invalidate_dependent_fragments(dependents)
+    transaction.on_commit(invalidate)
+
+def object_deleting(sender, instance, **kwargs):
+    # Looked up before the delete, while the object's relations are still there
+    dependents = dependent_fragments(instance)
+    transaction.on_commit(lambda: invalidate_dependent_fragments(dependents))
+
+def _related_pks(through, instance, model):
+    """Returns the pks of the objects of model related to instance through an m2m through table"""
+    source = next(field.name for field in through._meta.fields if field.related_model is type(instance))
+    target = next(field.name for field in through._meta.fields if field.related_model is model)
+    return set(through.objects.filter(**{source: instance.pk}).values_list(target, flat=True))
+
+def relations_changed(sender, instance, action, model, pk_set, **kwargs):
+    # Both sides are cleared, since either page may list the other
+    if action == 'pre_clear':
+        pk_set = _related_pks(sender, instance, model)
+    elif action not in ('post_add', 'post_remove'):
+        return
+    def invalidate():
+        invalidate_fragments(type(instance), [instance.pk])
+        invalidate_fragments(model, pk_set)
+    transaction.on_commit(invalidate)
+
+# Receivers are connected per model, as receivers for every model would stop Django deleting rows in bulk
+for model in set(DETAIL_MODELS) | set(FRAGMENT_DEPENDENCIES):
+    post_save.connect(object_saved, sender=model, dispatch_uid='cardonalab_fragments_%s' % model._meta.model_name)
+for model in FRAGMENT_DEPENDENCIES:
+    pre_save.connect(object_saving, sender=model, dispatch_uid='cardonalab_fragments_%s' % model._meta.model_name)
+    pre_delete.connect(object_deleting, sender=model, dispatch_uid='cardonalab_fragments_%s' % model._meta.model_name)
+for through in [Plasmid.primers.through, Protocol.tags.through]:
+    m2m_changed.connect(relations_changed, sender=through)
+
+### CRISPRi library filter counts
+
+@receiver(pre_save, sender=CrispriLibrary)
+def crispri_saving(sender, instance, raw=False, **kwargs):
+    instance._saved_facets = None
+    if not raw and not instance._state.adding:
+        saved = CrispriLibrary.objects.filter(pk=instance.pk).first()
+        instance._saved_facets = facet_values(saved) if saved else None
+
+@receiver(post_save, sender=CrispriLibrary)
+def crispri_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_facets(getattr(instance, '_saved_facets', None), facet_values(instance))
+
+@receiver(post_delete, sender=CrispriLibrary)
+def crispri_deleted(sender, instance, **kwargs):
+    update_facets(facet_values(instance), None)
@@ -0,0 +1,135 @@
+import csv
+import io
+import os
+import zipfile
+
+class SpreadsheetError(Exception):
+    """Raised when an uploaded file can't be read as a spreadsheet"""
+    pass
+
+XLSX_EXTENSIONS = ('.xlsx', '.xlsm')
+CSV_DELIMITERS = {'.csv': ',', '.tsv': '\t', '.txt': '\t'}
+SUPPORTED_EXTENSIONS = XLSX_EXTENSIONS + tuple(CSV_DELIMITERS) + ('.xls',)
+
+def _clean(values):
+    """Converts a row to a list with empty cells as '' (like xlrd) and trailing empty cells removed"""
+    row = ['' if value is None else value for value in values]
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+def _open_xlsx(file):
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+    try:
+        return openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError, OSError) as e:
+        raise SpreadsheetError(str(e)) from e
+
+def _xlsx_rows(file, sheet=None):
+    workbook = _open_xlsx(file)
+    try:
+        if sheet is None:
+            worksheet = workbook.worksheets[0]
+        elif sheet in workbook.sheetnames:
+            worksheet = workbook[sheet]
+        else:
+            raise SpreadsheetError('No sheet named "%s"' % sheet)
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _csv_rows(file, delimiter):
+    try:
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, encoding='utf-8-sig', newline='') as text:
+                yield from csv.reader(text, delimiter=delimiter)
+        elif isinstance(file, io.TextIOBase):
+            yield from csv.reader(file, delimiter=delimiter)
+        else:
+            text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+            try:
+                yield from csv.reader(text, delimiter=delimiter)
+            finally:
+                text.detach() # leave the upload open for its owner
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise SpreadsheetError(str(e)) from e
+
+def _xls_rows(file):
+    # Legacy .xls files need xlrd, which can't stream and reads the whole file
+    try:
+        import xlrd
+    except ImportError as e:
+        raise SpreadsheetError("Reading .xls files requires xlrd, save the file as .xlsx instead") from e
+    try:
+        if isinstance(file, (str, os.PathLike)):
+            book = xlrd.open_workbook(file, on_demand=True)
+        else:
+            book = xlrd.open_workbook(file_contents=file.read(), on_demand=True)
+    except xlrd.XLRDError as e:
+        raise SpreadsheetError(str(e)) from e
+    try:
+        sheet = book.sheet_by_index(0)
+        for i in range(sheet.nrows):
+            yield sheet.row_values(i)
+    finally:
+        book.release_resources()
+
+def _source(upload):
+    """Returns something the readers can open lazily: the path of uploads spooled to disk, otherwise a binary file"""
+    if hasattr(upload, 'temporary_file_path'):
+        return upload.temporary_file_path()
+    if hasattr(upload, 'seek'):
+        upload.seek(0)
+    # Django's in-memory uploads wrap the actual file object
+    return getattr(upload, 'file', upload)
+
+def _extension(upload, name):
+    name = name or getattr(upload, 'name', None) or str(upload)
+    return os.path.splitext(name)[1].lower()
+
+def sheet_names(upload, name=None):
+    """Returns the names of the visible sheets of an .xlsx workbook, or [None] for file types with a single sheet"""
+    if _extension(upload, name) not in XLSX_EXTENSIONS:
+        return [None]
+    workbook = _open_xlsx(_source(upload))
+    try:
+        return [worksheet.title for worksheet in workbook.worksheets if worksheet.sheet_state == 'visible']
+    finally:
+        workbook.close()
+
+def iter_rows(upload, name=None, sheet=None):
+    # upload is an uploaded file, a binary file or a path; name gives the file type when upload has no name.
+    # Empty cells are returned as '' and trailing empty rows are dropped.
+    extension = _extension(upload, name)
+    source = _source(upload)
+    if extension in XLSX_EXTENSIONS:
+        raw_rows = _xlsx_rows(source, sheet)
+    elif extension in CSV_DELIMITERS:
+        raw_rows = _csv_rows(source, CSV_DELIMITERS[extension])
+    elif extension == '.xls':
+        raw_rows = _xls_rows(source)
+    else:
+        raise SpreadsheetError("Unsupported file type " + (extension or "(no extension)"))
+
+    blank_rows = 0
+    try:
+        for values in raw_rows:
+            row = _clean(values)
+            if not row:
+                # Only yield blank rows once a non-blank row follows, so that row numbers stay correct
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                yield []
+            blank_rows = 0
+            yield row
+    finally:
+        raw_rows.close()
+
+def open_sheet(upload, name=None, sheet=None):
+    # Rows are padded to the width of the header, so optional trailing columns can be left empty
+    rows = iter_rows(upload, name, sheet)
+    header = next(rows, [])
+    width = len(header)
+    return header, (row + [''] * (width - len(row)) for row in rows)
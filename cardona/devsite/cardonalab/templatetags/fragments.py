@@ -0,0 +1,28 @@
+from django import template
+from django.core.cache import cache
+
+from ..fragments import FRAGMENT_TIMEOUT
+
+register = template.Library()
+
+class ObjectBodyNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        key = context.get('object_body_key')
+        if not key:
+            return self.nodelist.render(context)
+        # detail_view looks the fragment up first, to know whether the object's related rows need loading
+        body = context.get('object_body')
+        if body is None:
+            body = self.nodelist.render(context)
+            cache.set(key, body, FRAGMENT_TIMEOUT)
+        return body
+
+@register.tag
+def cacheobjectbody(parser, token):
+    """Caches what it encloses under the object_body_key of the context, when detail_view sets one"""
+    nodelist = parser.parse(('endcacheobjectbody',))
+    parser.delete_first_token()
+    return ObjectBodyNode(nodelist)
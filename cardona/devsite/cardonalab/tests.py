@@ -1,3 +1,1085 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from html import unescape
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.admin.models import LogEntry, ADDITION
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Bookmark, CrispriLibrary, CrispriFacet, Chemical, ChemicalCounter, File, Genome, Protocol, Tag, StorageLocation, Manufacturer, Primer, Plasmid, Strain, Stock, Library, LibStock, ImportJob
+from .importers import RowErrors, check_library_workbook, import_primers, build_libstocks, insert_library_stocks, import_chemicals, apply_library_stocks
+from .fragments import fragment_key
+from .facets import refresh_facets
+from .validation import check_primer_sheet, check_library_sheet
+from . import importers, jobs
+from .jobs import run_job, run_pending_jobs
+from .exports import csv_response, ndjson_response, xlsx_response
+from .resources import CrispriLibraryResource, IMPORT_FORMATS
+from .bookmarks import is_bookmarked, add_bookmark, remove_bookmark
+
+class CardonalabTestCase(TestCase):
+    """Runs every test logged in as a superuser, with an empty cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    @classmethod
+    def create_primer(cls, **fields):
+        return Primer.objects.create(**dict({'sequence': 'ATCG', 'tm': 60, 'creator': cls.user}, **fields))
+
+    @classmethod
+    def create_chemical(cls, name, label='A', **fields):
+        return Chemical.objects.create(name=name, label=label, creator=cls.user, **fields)
+
+    @staticmethod
+    def libstock(stock_id, letter='A', number=1, plate=1, **fields):
+        return LibStock(stock_id=stock_id, plate=plate, letter=letter, number=number, **dict({'species': 'M. smegmatis'}, **fields))
+
+    @classmethod
+    def create_libstock(cls, library, stock_id, letter='A', number=1, plate=1, **fields):
+        stock = cls.libstock(stock_id, letter, number, plate, library=library, **fields)
+        stock.save()
+        return stock
+
+class ChangelistQueryBudgetTests(CardonalabTestCase):
+    """Changelists run a fixed number of queries however many rows they show.
+
+    A link column that follows a foreign key without declaring it in its select_related attribute adds a query per
+    row, which these tests catch by rendering each changelist with few and with many rows.
+    """
+    # Session, user, count, rows, filters and the like. Raise only when a changelist deliberately gains a query.
+    BUDGET = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.library = Library.objects.create(name='Library')
+
+    def setUp(self):
+        super().setUp()
+        self.rows = 0
+
+    def add_rows(self, count):
+        for i in range(self.rows, self.rows + count):
+            primer = self.create_primer()
+            self.create_libstock(self.library, str(i), plate=1 + i // 96, forward_primer=primer)
+            Stock.objects.create(strain=Strain.objects.create(name='Strain %d' % i, creator=self.user),
+                                 plasmid=Plasmid.objects.create(name='Plasmid %d' % i, creator=self.user), creator=self.user)
+            self.create_chemical('Chemical %d' % i, manufacturer=Manufacturer.objects.create(name='Manufacturer %d' % i),
+                                 location=StorageLocation.objects.create(name='Location %d' % i))
+        self.rows += count
+
+    def count_queries(self, url):
+        # Some changelists cache their counts, measure them cold
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueryBudget(self, url):
+        self.add_rows(2)
+        few = self.count_queries(url)
+        self.add_rows(20)
+        many = self.count_queries(url)
+        self.assertEqual(few, many, "%s runs queries per row" % url)
+        self.assertLessEqual(many, self.BUDGET)
+
+    def test_stock_changelist(self):
+        self.assertQueryBudget('/cardonalab/stock/')
+
+    def test_libstock_changelist(self):
+        self.assertQueryBudget('/cardonalab/libstock/?library__id__exact=%d' % self.library.pk)
+
+    def test_chemical_changelist(self):
+        self.assertQueryBudget('/cardonalab/chemical/')
+
+    def test_library_changelist(self):
+        self.assertQueryBudget('/cardonalab/library/')
+
+class KeysetPaginationTests(CardonalabTestCase):
+    """Following the Next links of a keyset changelist visits every row once, in the changelist's order"""
+
+    def walk(self, url, pattern):
+        rows, response = [], self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            content = response.content.decode()
+            rows += re.findall(pattern, content)
+            next_link = re.search(r'<a href="([^"]*)">Next', content)
+            if not next_link:
+                return rows
+            response = self.client.get(url.split('?')[0] + unescape(next_link.group(1)))
+
+    def test_primer_pages(self):
+        for i in range(230):
+            self.create_primer(template='Template %d' % (i % 7))
+        rows = self.walk('/cardonalab/primer/?o=2.-1', r'/primer/(\d+)/view/')
+        expected = Primer.objects.order_by('location', '-template', '-pk').values_list('pk', flat=True)
+        self.assertEqual([int(pk) for pk in rows], list(expected))
+
+    def test_null_plates(self):
+        CrispriLibrary.objects.bulk_create([CrispriLibrary(boxNo='1', plate=None if i % 10 == 0 else i % 4, wellLetter='A',
+                                                           wellNo=i % 12, locusTag='Locus %d' % i) for i in range(230)])
+        rows = self.walk('/cardonalab/crisprilibrary/', r'<td class="field-locusTag">([^<]*)<')
+        expected = CrispriLibrary.objects.order_by(F('plate').asc(nulls_last=True), 'wellLetter', 'wellNo', '-pk')
+        self.assertEqual(rows, list(expected.values_list('locusTag', flat=True)))
+
+class ChemicalImportTests(CardonalabTestCase):
+    """Bulk imported chemicals get the codes saving them one by one would have given them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.sigma = Manufacturer.objects.create(name='Sigma')
+        cls.create_chemical('Agar', manufacturer=cls.sigma)
+
+    def test_codes_and_names(self):
+        rows = [['L-Arginine', '', 'sigma', 'Fridge'], ['Bromophenol blue', 'b', 'Fisher', 'fridge'], ['Acetone', 'A']]
+        chemicals = import_chemicals(rows, self.user)
+        self.assertEqual([chemical.code for chemical in chemicals], ['A2', 'B1', 'A3'])
+        self.assertEqual(list(Chemical.objects.order_by('pk').values_list('code', flat=True)), ['A1', 'A2', 'B1', 'A3'])
+        self.assertEqual(chemicals[0].manufacturer_id, self.sigma.pk)
+        self.assertEqual(list(Manufacturer.objects.order_by('pk').values_list('name', flat=True)), ['Sigma', 'Fisher'])
+        self.assertEqual(list(StorageLocation.objects.values_list('name', flat=True)), ['Fridge'])
+        # Chemicals saved afterwards carry on from the imported numbers
+        self.assertEqual(self.create_chemical('Acid').code, 'A4')
+
+class ChemicalNumberTests(CardonalabTestCase):
+    """Chemicals saved with a number of their own move the label's counter past it"""
+
+    def test_explicit_number(self):
+        self.create_chemical('Agar')
+        self.create_chemical('Acetone', 'A', number=5)
+        self.assertEqual(self.create_chemical('Acid').code, 'A6')
+
+    def test_explicit_number_first(self):
+        self.create_chemical('Bromophenol blue', 'B', number=3)
+        self.assertEqual(self.create_chemical('Bleach', 'B').code, 'B4')
+
+    def test_lower_number(self):
+        # Filling a gap leaves the counter where it was
+        for name in ['Agar', 'Acetone', 'Acid']:
+            self.create_chemical(name)
+        Chemical.objects.filter(number=2).delete()
+        self.create_chemical('Ampicillin', 'A', number=2)
+        self.assertEqual(self.create_chemical('Agarose').code, 'A4')
+
+class ChemicalChangelistTests(CardonalabTestCase):
+    def codes(self, **params):
+        response = self.client.get('/cardonalab/chemical/', params)
+        self.assertEqual(response.status_code, 200)
+        return [chemical.code for chemical in response.context['cl'].result_list]
+
+    def test_search_by_code(self):
+        for number in [1, 2, 10, 11]:
+            self.create_chemical('Acid %d' % number, number=number)
+        self.create_chemical('Vitamin A99', 'V')
+        self.assertEqual(self.codes(q='A1'), ['A1'])
+        self.assertEqual(self.codes(q=' a01 '), ['A1'])
+        # Not a code in use, so searched for in names
+        self.assertEqual(self.codes(q='A99'), ['V1'])
+
+    def test_code_ordering(self):
+        # Codes sort by label, then by number rather than as text
+        for name, label, number in [('Acid', 'A', 10), ('Bleach', 'B', 1), ('Agar', 'A', 2), ('Acetone', 'A', 1)]:
+            self.create_chemical(name, label, number=number)
+        self.assertEqual(self.codes(o='0'), ['A1', 'A2', 'A10', 'B1'])
+        self.assertEqual(self.codes(o='-0'), ['B1', 'A10', 'A2', 'A1'])
+
+class LibraryUpdateTests(CardonalabTestCase):
+    """Re-importing a library keeps the rows of stocks that are still in the sheet"""
+
+    def setUp(self):
+        super().setUp()
+        self.library = Library.objects.create(name='Library')
+
+    def stock_ids(self):
+        return dict(self.library.libstock_set.values_list('stock_id', 'pk'))
+
+    def test_move_and_insert(self):
+        # New stock "C" goes in the well that stock "1" moves out of
+        primer = self.create_primer()
+        one = self.create_libstock(self.library, '1', forward_primer=primer)
+        changes = apply_library_stocks(self.library, [self.libstock('C'), self.libstock('1', 'A', 3, forward_primer=primer)],
+                                       self.user)
+        self.assertEqual(changes, (1, 1, 0, 0))
+        stock_ids = self.stock_ids()
+        self.assertEqual(stock_ids['1'], one.pk)
+        self.assertNotEqual(stock_ids['C'], one.pk)
+        one.refresh_from_db()
+        self.assertEqual((one.letter, one.number, one.forward_primer_id), ('A', 3, primer.pk))
+
+    def test_match_by_well(self):
+        # A corrected stock id keeps the row of the stock in its well
+        old = self.create_libstock(self.library, '1')
+        self.create_libstock(self.library, '2', 'A', 2)
+        changes = apply_library_stocks(self.library, [self.libstock('1b')], self.user)
+        self.assertEqual(changes, (0, 1, 1, 0))
+        self.assertEqual(self.stock_ids(), {'1b': old.pk})
+
+    def test_keep_missing(self):
+        self.create_libstock(self.library, '1')
+        changes = apply_library_stocks(self.library, [self.libstock('1'), self.libstock('2', 'A', 2)], self.user,
+                                       remove_missing=False)
+        self.assertEqual(changes, (1, 0, 0, 1))
+
+class LibraryChangelistTests(CardonalabTestCase):
+    def columns(self):
+        response = self.client.get('/cardonalab/library/')
+        self.assertEqual(response.status_code, 200)
+        cl = response.context['cl']
+        return {library.name: [getattr(cl.model_admin, column)(library)
+                               for column in ['num_stocks', 'plates_used', 'wells_filled', 'num_species']]
+                for library in cl.result_list}
+
+    def test_summary_columns(self):
+        Library.objects.create(name='Empty')
+        library = Library.objects.create(name='Filled')
+        self.create_libstock(library, '1')
+        self.create_libstock(library, '2', 'A', 11)
+        self.create_libstock(library, '3', 'A', 1, plate=11, species='M. tuberculosis')
+        self.create_libstock(library, '4', 'A', 11) # entered twice by hand
+        self.assertEqual(self.columns(), {'Empty': [0, 0, 0, 0], 'Filled': [4, 2, 3, 2]})
+
+class PlateMapTests(CardonalabTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.library = Library.objects.create(name='Library')
+        cls.first = cls.create_libstock(cls.library, '1', gene_target='dnaA')
+        cls.create_libstock(cls.library, '2') # entered in the same well by hand
+        cls.create_libstock(cls.library, '3', 'H', 12)
+        cls.create_libstock(cls.library, '4', 'A', 25) # past the last column of any plate
+        cls.create_libstock(cls.library, '5', 'P', 24, plate=2)
+
+    def get(self, plate=None):
+        url = '/cardonalab/library/%d/plates/' % self.library.pk + ('%d/' % plate if plate else '')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_wells(self):
+        response = self.get()
+        plate_map = response.context['plate_map']
+        self.assertEqual(response.context['plate'], 1)
+        self.assertEqual(plate_map.shape, (8, 12))
+        self.assertEqual([stock.stock_id for stock in plate_map.wells[0, 0]], ['1', '2'])
+        self.assertEqual([stock.stock_id for stock in plate_map.wells[7, 11]], ['3'])
+        self.assertEqual((plate_map.filled, plate_map.shared), (2, 1))
+        self.assertEqual([stock.stock_id for stock in plate_map.unplaced], ['4'])
+        content = response.content.decode()
+        self.assertContains(response, "2 of 96 wells filled, 1 holding more than one stock")
+        self.assertEqual(content.count('<td class="empty">'), 94)
+        self.assertEqual(content.count('<td class="shared">'), 1)
+        self.assertContains(response, '<a href="/cardonalab/libstock/%d/view/">1</a>' % self.first.pk)
+        self.assertContains(response, '<small>dnaA</small>')
+        self.assertContains(response, "Stocks on this plate with a well outside the grid")
+
+    def test_large_plate(self):
+        # A well past H12 shows the plate as a 384-well plate
+        response = self.get(2)
+        self.assertEqual(response.context['plate_map'].shape, (16, 24))
+        self.assertContains(response, "1 of 384 wells filled")
+
+    def test_missing_plate(self):
+        response = self.get(3)
+        self.assertIsNone(response.context['plate_map'])
+        self.assertContains(response, "This library has no stocks on plate 3.")
+
+class BookmarkTests(CardonalabTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.primer = cls.create_primer()
+
+    def test_bookmarks_page_needs_login(self):
+        self.client.logout()
+        response = self.client.get('/cardonalab/bookmarks/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login/', response['Location'])
+
+    def test_add_and_remove(self):
+        self.client.get('/cardonalab/primer/%d/add_bookmark/' % self.primer.pk)
+        self.assertContains(self.client.get('/cardonalab/bookmarks/'), '/primer/%d/view/' % self.primer.pk)
+        self.assertContains(self.client.get('/cardonalab/primer/%d/view/' % self.primer.pk), 'Remove Bookmark')
+        self.client.get('/cardonalab/primer/%d/remove_bookmark/' % self.primer.pk)
+        self.assertNotContains(self.client.get('/cardonalab/bookmarks/'), '/primer/%d/view/' % self.primer.pk)
+        self.assertNotContains(self.client.get('/cardonalab/primer/%d/view/' % self.primer.pk), 'Remove Bookmark')
+
+    def test_not_bookmarkable(self):
+        # Import jobs aren't listed on the bookmarks page
+        job = ImportJob.objects.create(creator=self.user, kind=ImportJob.PRIMERS, status=ImportJob.DONE)
+        self.assertNotContains(self.client.get('/cardonalab/importjob/%d/view/' % job.pk), 'add_bookmark')
+        self.assertEqual(self.client.get('/cardonalab/importjob/%d/add_bookmark/' % job.pk).status_code, 302)
+        self.assertFalse(Bookmark.objects.exists())
+
+    def test_membership(self):
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(is_bookmarked(user, Primer, self.primer.pk))
+        add_bookmark(user, Primer, self.primer.pk)
+        self.assertTrue(is_bookmarked(user, Primer, self.primer.pk))
+        # Later checks for the same user are answered from memory
+        with self.assertNumQueries(0):
+            for i in range(100):
+                is_bookmarked(user, Primer, i)
+        remove_bookmark(user, Primer, self.primer.pk)
+        self.assertFalse(is_bookmarked(user, Primer, self.primer.pk))
+
+    def test_deleted_object(self):
+        # The cached bookmarks are dropped when the bookmark goes with its object
+        primer = self.create_primer(sequence='GGCC')
+        link = '/primer/%d/view/' % primer.pk
+        self.client.get('/cardonalab/primer/%d/add_bookmark/' % primer.pk)
+        self.assertContains(self.client.get('/cardonalab/bookmarks/'), link)
+        primer.delete()
+        self.assertNotContains(self.client.get('/cardonalab/bookmarks/'), link)
+        self.assertFalse(Bookmark.objects.exists())
+
+    def test_dangling_bookmark(self):
+        # Bookmarks of rows deleted outside the ORM are left off the page, and deleted by prune_bookmarks
+        primer = self.create_primer(sequence='GGCC')
+        link = '/primer/%d/view/' % primer.pk
+        add_bookmark(self.user, Primer, primer.pk)
+        add_bookmark(self.user, Primer, self.primer.pk)
+        Primer.objects.filter(pk=primer.pk)._raw_delete(connection.alias)
+        response = self.client.get('/cardonalab/bookmarks/')
+        self.assertNotContains(response, link)
+        self.assertContains(response, '/primer/%d/view/' % self.primer.pk)
+        self.assertEqual(Bookmark.objects.count(), 2)
+        output = io.StringIO()
+        call_command('prune_bookmarks', stdout=output)
+        self.assertEqual(output.getvalue(), "Deleted 1 bookmark(s)\n")
+        self.assertEqual(list(Bookmark.objects.values_list('object_id', flat=True)), [self.primer.pk])
+
+class FragmentInvalidationTests(CardonalabTestCase):
+    """Cached detail page bodies are cleared when anything they show changes"""
+
+    def setUp(self):
+        super().setUp()
+        self.primer = self.create_primer()
+        self.plasmid = Plasmid.objects.create(name='plasmid', creator=self.user)
+        self.plasmid.primers.add(self.primer)
+        self.library = Library.objects.create(name='Library')
+        self.stock = self.create_libstock(self.library, '1', forward_primer=self.primer)
+
+    def page(self, model, pk):
+        return self.client.get('/cardonalab/%s/%d/view/' % (model._meta.model_name, pk)).content.decode()
+
+    def assertCleared(self, model, pk, change):
+        key = fragment_key(model, pk)
+        # Fragments are cleared once the change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertNotEqual(fragment_key(model, pk), key)
+
+    def test_primer_edit(self):
+        self.assertCleared(Plasmid, self.plasmid.pk, lambda: Primer.objects.get(pk=self.primer.pk).save())
+        self.assertCleared(LibStock, self.stock.pk, lambda: Primer.objects.get(pk=self.primer.pk).save())
+
+    def test_primer_delete(self):
+        link = '/primer/%d/view/' % self.primer.pk
+        self.assertIn(link, self.page(Plasmid, self.plasmid.pk))
+        self.assertIn(link, self.page(LibStock, self.stock.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.primer.delete()
+        self.assertNotIn(link, self.page(Plasmid, self.plasmid.pk))
+        self.assertNotIn(link, self.page(LibStock, self.stock.pk))
+
+    def test_primers_changed(self):
+        primer = self.create_primer(sequence='GGCC')
+        self.assertCleared(Plasmid, self.plasmid.pk, lambda: self.plasmid.primers.add(primer))
+        self.assertCleared(Primer, primer.pk, lambda: self.plasmid.primers.remove(primer))
+        self.assertCleared(Plasmid, self.plasmid.pk, lambda: self.plasmid.primers.clear())
+
+    def test_chemical_moved(self):
+        # Both the old and the new location list the chemical
+        old, new = StorageLocation.objects.create(name='Fridge'), StorageLocation.objects.create(name='Shelf')
+        chemical = self.create_chemical('Agar', location=old)
+        chemical.location = new
+        self.assertCleared(StorageLocation, old.pk, chemical.save)
+        chemical.location = old
+        self.assertCleared(StorageLocation, new.pk, chemical.save)
+
+LIBRARY_HEADER = "Stock ID,Plate #,Well Letter,Well #,Species,Gene Target,Forward Primer,Resistance,Notes\n"
+
+def library_sheet(count):
+    return LIBRARY_HEADER + "".join("%d,1,%s,%d,M. smegmatis,,,,\n" % (i, "ABCDEFGH"[i // 12], i % 12 + 1) for i in range(count))
+
+def library_workbook(sheets):
+    # sheets: {sheet name: (plate, stock ids)}
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for name, (plate, stock_ids) in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        worksheet.append(LIBRARY_HEADER.strip().split(','))
+        for i, stock_id in enumerate(stock_ids):
+            worksheet.append([str(stock_id), plate, "ABCDEFGH"[i // 12], i % 12 + 1, 'M. smegmatis'])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+class ImportJobTests(CardonalabTestCase):
+    def tearDown(self):
+        # Finished jobs delete their upload, the others leave it in the spool directory
+        for job in ImportJob.objects.all():
+            job.source.storage.delete(job.source.name)
+
+    def job(self, kind, content, name='upload.csv', **fields):
+        content = content.encode() if isinstance(content, str) else content
+        return ImportJob.objects.create(creator=self.user, kind=kind, source=ContentFile(content, name=name), **fields)
+
+    def make_stale(self, job):
+        # As a job left running by a restart
+        stale = timezone.now() - datetime.timedelta(seconds=ImportJob.stale_after() + 1)
+        ImportJob.objects.filter(pk=job.pk).update(updated=stale)
+
+    def test_primers(self):
+        job = self.job(ImportJob.PRIMERS, "Sequence,Tm,Template,Location,Restriction sites,Notes\nATCG,60,,,,\nGGCC,55,,,,\n")
+        self.assertTrue(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 2)
+        self.assertEqual(Primer.objects.count(), 2)
+        # A job only runs once
+        self.assertFalse(run_job(job.pk))
+
+    def test_error_report(self):
+        job = self.job(ImportJob.PRIMERS, "Sequence,Tm,Template,Location,Restriction sites,Notes\nATCG,60,,,,\nXYZ,hot,,,,\n")
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn("Row 3, Sequence: is not a valid DNA sequence", job.errors)
+        self.assertIn("Row 3, Tm: must be a number", job.errors)
+        self.assertFalse(Primer.objects.exists())
+
+    def test_wrong_columns(self):
+        job = self.job(ImportJob.PRIMERS, "Sequence,Tm\nATCG,60\n")
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn("Incorrect number of columns", job.errors)
+
+    def test_library(self):
+        job = self.job(ImportJob.LIBRARY, library_sheet(30), library_name='New library')
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE, job.errors)
+        self.assertEqual(job.library.name, 'New library')
+        self.assertEqual(job.library.libstock_set.count(), 30)
+
+    @override_settings(CARDONALAB_IMPORT_BATCH_SIZE=10)
+    def test_resume_from_checkpoint(self):
+        # A job interrupted after committing its first batch carries on with the rest of the sheet
+        library = Library.objects.create(name='Library')
+        for i in range(10):
+            self.create_libstock(library, str(i), 'A', i + 1)
+        job = self.job(ImportJob.LIBRARY, library_sheet(25), library_name='Library', library=library, status=ImportJob.RUNNING,
+                       checkpoint=10, started=timezone.now())
+        self.make_stale(job)
+        self.assertFalse(run_job(job.pk))
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE, job.errors)
+        self.assertEqual(sorted(int(stock_id) for stock_id in library.libstock_set.values_list('stock_id', flat=True)), list(range(25)))
+
+    @override_settings(CARDONALAB_IMPORT_BATCH_SIZE=10)
+    def test_crash_keeps_checkpoint(self):
+        # A library job that crashes part way is left running, with its library hidden, for the runner to resume
+        job = self.job(ImportJob.LIBRARY, library_sheet(25), library_name='Library')
+        insert = jobs.insert_library_stocks
+        def crash(library, stocks, user, start=0, checkpoint=None):
+            insert(library, stocks[:10], user, start, checkpoint)
+            raise OSError("Lost the database")
+        with mock.patch.object(jobs, 'insert_library_stocks', crash), self.assertLogs('cardonalab.jobs', 'ERROR'):
+            self.assertTrue(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.checkpoint), (ImportJob.RUNNING, 10))
+        self.assertEqual(job.library.libstock_set.count(), 10)
+        self.assertNotContains(self.client.get('/cardonalab/library/'), 'Library</b>')
+        self.make_stale(job)
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE, job.errors)
+        self.assertEqual(job.library.libstock_set.count(), 25)
+        self.assertContains(self.client.get('/cardonalab/library/'), 'Library</b>')
+
+    @override_settings(CARDONALAB_IMPORT_BATCH_SIZE=10)
+    def test_resume_workbook(self):
+        # Resuming a workbook with several sheets leaves out the stocks committed before, as for a single sheet
+        workbook = library_workbook({'Plate 1': (1, range(0, 15)), 'Plate 2': (2, range(15, 25))})
+        job = self.job(ImportJob.LIBRARY, workbook, name='upload.xlsx', library_name='Library')
+        insert = jobs.insert_library_stocks
+        def crash(library, stocks, user, start=0, checkpoint=None):
+            insert(library, stocks[:10], user, start, checkpoint)
+            raise OSError("Lost the database")
+        with mock.patch.object(jobs, 'insert_library_stocks', crash), self.assertLogs('cardonalab.jobs', 'ERROR'):
+            run_job(job.pk)
+        self.make_stale(job)
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE, job.errors)
+        stocks = job.library.libstock_set.values_list('stock_id', 'plate')
+        self.assertEqual(sorted((int(stock_id), plate) for stock_id, plate in stocks),
+                         [(i, 1 if i < 15 else 2) for i in range(25)])
+
+    def test_invalid_file_removes_library(self):
+        # A resumed job whose file no longer validates doesn't leave the stocks of its first run behind
+        library = Library.objects.create(name='Library')
+        self.create_libstock(library, '0')
+        job = self.job(ImportJob.LIBRARY, library_sheet(2) + "2,1,Z,1,,,,,\n", library_name='Library', library=library,
+                       status=ImportJob.RUNNING, checkpoint=1, started=timezone.now())
+        self.make_stale(job)
+        self.assertTrue(run_job(job.pk, resume=True))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIsNone(job.library)
+        self.assertFalse(Library.objects.exists())
+
+    def test_start_runner(self):
+        # Only processes that opt in sweep for jobs left by a restart as Django starts
+        config = apps.get_app_config('cardonalab')
+        with mock.patch.object(jobs, 'start_runner') as start_runner:
+            config.ready()
+            self.assertFalse(start_runner.called)
+            with self.settings(CARDONALAB_IMPORT_START_RUNNER=True):
+                config.ready()
+            self.assertTrue(start_runner.called)
+
+    def test_running_job_not_resumed(self):
+        job = self.job(ImportJob.PRIMERS, "", status=ImportJob.RUNNING, started=timezone.now())
+        self.assertEqual(run_pending_jobs(), 0)
+        self.assertFalse(run_job(job.pk, resume=True))
+
+    def test_pending_jobs(self):
+        # Pending jobs whose thread was lost in a restart are run by the next sweep
+        header = "Sequence,Tm,Template,Location,Restriction sites,Notes\n"
+        for sequence in ['ATCG', 'GGCC']:
+            self.job(ImportJob.PRIMERS, header + sequence + ",60,,,,\n")
+        self.assertEqual(run_pending_jobs(), 2)
+        self.assertEqual(ImportJob.objects.filter(status=ImportJob.DONE).count(), 2)
+
+class ChemicalCodeConcurrencyTests(TransactionTestCase):
+    """Imports and single chemicals numbered at the same time never share a code"""
+
+    def test_concurrent_imports(self):
+        user = User.objects.create_user('user')
+        start = threading.Barrier(4)
+        errors = []
+        def run(worker):
+            try:
+                start.wait()
+                for i in range(5):
+                    # SQLite locks whole tables and fails rather than waits, a transaction that hits a lock is retried
+                    while True:
+                        try:
+                            if worker % 2:
+                                import_chemicals([['Acid %d-%d-%d' % (worker, i, j), 'A'] for j in range(3)], user)
+                            else:
+                                Chemical.objects.create(name='Acid %d-%d' % (worker, i), label='A', creator=user)
+                            break
+                        except OperationalError as e:
+                            if 'locked' not in str(e):
+                                raise
+                            time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        numbers = sorted(Chemical.objects.values_list('number', flat=True))
+        self.assertEqual(numbers, list(range(1, 2 * 5 * 3 + 2 * 5 + 1)))
+        self.assertEqual(ChemicalCounter.objects.get(label='A').last_number, len(numbers))
+
+@override_settings(CARDONALAB_IMPORT_STALE_AFTER=0.4)
+class ImportJobHeartbeatTests(TransactionTestCase):
+    """A job stays fresh while it runs, even through phases that report no progress"""
+
+    def test_heartbeat(self):
+        user = User.objects.create_user('user')
+        job = ImportJob.objects.create(creator=user, kind=ImportJob.PRIMERS, source=ContentFile(b"", name='upload.csv'))
+        seen = []
+        def slow_import(job):
+            time.sleep(1)
+            # Longer than CARDONALAB_IMPORT_STALE_AFTER without progress, yet not taken for interrupted
+            seen.append(ImportJob.objects.get(pk=job.pk).is_interrupted())
+            return "Done"
+        with mock.patch.dict(jobs.RUNNERS, {ImportJob.PRIMERS: slow_import}):
+            run_job(job.pk)
+        self.assertEqual(seen, [False])
+        self.assertFalse(run_job(job.pk, resume=True))
+
+class PrimerImportTests(CardonalabTestCase):
+    """Primer sheets are imported in batches within one transaction, all rows or none"""
+
+    def rows(self, count):
+        return [['atcg', 60, 'Template %d' % i, 'Box 1', '', ''] for i in range(count)]
+
+    def test_import(self):
+        primers = import_primers(self.rows(25), self.user, batch_size=10)
+        self.assertEqual(Primer.objects.count(), 25)
+        self.assertEqual([primer.pk for primer in primers], list(Primer.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(Primer.objects.filter(sequence='ATCG', creator=self.user).count(), 25)
+        self.assertEqual(LogEntry.objects.filter(action_flag=ADDITION).count(), 25)
+
+    def test_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            import_primers(self.rows(25), self.user, batch_size=10)
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "cardonalab_primer"')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_invalid_row(self):
+        rows = self.rows(5) + [['ATCG', 150, '', '', '', '']]
+        with self.assertRaises(RowErrors) as raised:
+            import_primers(rows, self.user, batch_size=2)
+        self.assertEqual(raised.exception.rows, [7])
+        self.assertFalse(Primer.objects.exists())
+        self.assertFalse(LogEntry.objects.exists())
+
+    def test_progress(self):
+        counts = []
+        import_primers(self.rows(25), self.user, batch_size=10, progress=counts.append)
+        self.assertEqual(counts, [10, 20, 25])
+
+class LibraryImportTests(CardonalabTestCase):
+    """Library sheets have their forward primers looked up with one query and their stocks inserted in batches"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.primers = [cls.create_primer() for i in range(3)]
+
+    def rows(self, count, primer=None):
+        primer = primer or self.primers[0].pk
+        return [[str(i), 1, 'ABCDEFGH'[i // 12], i % 12 + 1, 'M. smegmatis', 'gene', primer, '', ''] for i in range(count)]
+
+    def test_primer_lookup(self):
+        for count in (2, 40):
+            with self.assertNumQueries(1):
+                stocks = build_libstocks(self.rows(count))
+            self.assertEqual(len(stocks), count)
+            self.assertTrue(all(stock.forward_primer_id == self.primers[0].pk for stock in stocks))
+
+    def test_missing_primer(self):
+        rows = self.rows(3)
+        rows[1][6] = max(primer.pk for primer in self.primers) + 1
+        with self.assertRaises(RowErrors) as raised:
+            build_libstocks(rows)
+        self.assertIn("Row 3, Forward Primer: does not exist", raised.exception.describe())
+
+    def test_insert_in_batches(self):
+        library = Library.objects.create(name='Library')
+        checkpoints = []
+        count = insert_library_stocks(library, build_libstocks(self.rows(25)), self.user, checkpoint=checkpoints.append,
+                                      batch_size=10)
+        self.assertEqual(count, 25)
+        self.assertEqual(checkpoints, [10, 20, 25])
+        self.assertEqual(library.libstock_set.count(), 25)
+        self.assertEqual(LogEntry.objects.filter(action_flag=ADDITION).count(), 25)
+
+class SheetValidationTests(CardonalabTestCase):
+    """Sheets are checked column by column, reporting every problem with the row number users see in Excel"""
+
+    def problems(self, report):
+        return [(error.row, error.column, error.message) for error in report.sorted_errors()]
+
+    def test_primer_sheet(self):
+        cleaned, report = check_primer_sheet([['atcg', '61.5', 'T'], ['', 60], ['ATXG', 101], ['ATCG', 'hot']])
+        self.assertEqual(self.problems(report), [
+            (3, 'Sequence', "is required"),
+            (4, 'Sequence', "is not a valid DNA sequence"),
+            (4, 'Tm', "must be between 0 and 100"),
+            (5, 'Tm', "must be a number"),
+        ])
+        self.assertEqual(cleaned['sequence'][0], 'ATCG')
+        self.assertEqual(cleaned['tm'][0], 61.5)
+
+    def test_library_sheet(self):
+        rows = [['1', 1, 'a', 1, 'M. smegmatis'], ['2', 1, 'A', 1, 'M. smegmatis'], ['3', 1.5, 'Z', 25, ''],
+                [4.0, 2, 'B', 2, 'M. tuberculosis', '', 'primer']]
+        cleaned, report = check_library_sheet(rows)
+        self.assertEqual(self.problems(report), [
+            (2, 'Well', "is used by more than one row"),
+            (3, 'Well', "is used by more than one row"),
+            (4, 'Plate #', "must be a whole number"),
+            (4, 'Well Letter', "must be a letter from A to P"),
+            (4, 'Well #', "must be a whole number from 1 to 24"),
+            (4, 'Species', "is required"),
+            (5, 'Forward Primer', "must be a primer id"),
+        ])
+        # Excel's numeric stock ids read as whole numbers
+        self.assertEqual(cleaned['stock_id'][3], '4')
+        self.assertEqual(cleaned['letter'][0], 'A')
+
+    def test_check_only(self):
+        sheet = b"Sequence,Tm,Template,Location,Restriction sites,Notes\nATCG,60,,,,\nATCG,hot,,,,\n"
+        response = self.client.post('/cardonalab/primer/add_multiple',
+                                    {'excel_file': SimpleUploadedFile('primers.csv', sheet), 'validate_only': 'on'})
+        self.assertContains(response, "Found 1 problem in 1 of 2 rows")
+        self.assertContains(response, "must be a number")
+        self.assertFalse(Primer.objects.exists())
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_check_only_clean(self):
+        sheet = b"Sequence,Tm,Template,Location,Restriction sites,Notes\nATCG,60,,,,\n"
+        response = self.client.post('/cardonalab/primer/add_multiple',
+                                    {'excel_file': SimpleUploadedFile('primers.csv', sheet), 'validate_only': 'on'})
+        self.assertContains(response, "No problems found in 1 row")
+        self.assertFalse(ImportJob.objects.exists())
+
+class WorkbookCheckTests(CardonalabTestCase):
+    """The sheets of a library workbook are checked the same in worker processes as in the importing process"""
+
+    def setUp(self):
+        import openpyxl
+        super().setUp()
+        workbook = library_workbook({'Plate 1': (1, range(0, 12)), 'Plate 2': (2, range(12, 20)), 'Plate 3': (3, range(20, 24))})
+        # Plate 2 has a bad well, and plate 3 a well taken on plate 1
+        workbook = openpyxl.load_workbook(io.BytesIO(workbook))
+        workbook['Plate 2']['C4'] = 'Z'
+        workbook['Plate 3'].append(['99', 1, 'A', 1, 'M. smegmatis'])
+        handle, self.path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        workbook.save(self.path)
+
+    def check(self, **kwargs):
+        with mock.patch.object(importers, '_check_sheets_in_processes', wraps=importers._check_sheets_in_processes) as parallel:
+            cleaned, report = check_library_workbook(self.path, workers=2, **kwargs)
+        errors = [(error.sheet, error.row, error.column) for error in report.sorted_errors()]
+        return parallel.called, list(cleaned['stock_id']), errors
+
+    def test_parallel(self):
+        parallel, stock_ids, errors = self.check(parallel_min_size=0)
+        self.assertTrue(parallel)
+        self.assertEqual(stock_ids, [str(i) for i in range(24)] + ['99'])
+        self.assertEqual(errors, [('Plate 1', 2, 'Well'), ('Plate 2', 4, 'Well Letter'), ('Plate 3', 6, 'Well')])
+        self.assertEqual((False, stock_ids, errors), self.check())
+
+    @override_settings(CARDONALAB_IMPORT_PARALLEL_MIN_SIZE=0)
+    def test_setting(self):
+        self.assertTrue(self.check()[0])
+
+class SpreadsheetFormatTests(CardonalabTestCase):
+    """Every supported file type reads the same through the uploads and the CRISPRi library import"""
+    ROWS = [['Sequence', 'Tm', 'Template', 'Location', 'Restriction sites', 'Notes'], ['ATCG', 60, 'pUC19', '', '', ''],
+            ['GGCC', 55.5, '', 'Box 1', '', 'spare']]
+
+    def sheet(self, extension):
+        if extension == '.xlsx':
+            import openpyxl
+            workbook = openpyxl.Workbook()
+            for row in self.ROWS:
+                workbook.active.append([value if value != '' else None for value in row])
+            output = io.BytesIO()
+            workbook.save(output)
+            return output.getvalue()
+        delimiter = ',' if extension == '.csv' else '\t'
+        return "".join(delimiter.join(str(value) for value in row) + "\n" for row in self.ROWS).encode()
+
+    def assertUploads(self, extension):
+        response = self.client.post('/cardonalab/primer/add_multiple',
+                                    {'excel_file': SimpleUploadedFile('primers' + extension, self.sheet(extension))})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, '/cardonalab/importjob/%d/view/' % job.pk, fetch_redirect_response=False)
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE, job.errors)
+        primers = Primer.objects.order_by('pk').values_list('sequence', 'tm', 'template', 'location', 'notes')
+        self.assertEqual(list(primers), [('ATCG', 60, 'pUC19', '', ''), ('GGCC', 55.5, '', 'Box 1', 'spare')])
+        # The CRISPRi library import reads the same file type with the same reader
+        format = next(format for format in IMPORT_FORMATS if format().get_extension() == extension[1:])
+        dataset = format().create_dataset(self.sheet(extension))
+        self.assertEqual(dataset.headers, self.ROWS[0])
+        self.assertEqual([row[0] for row in dataset], ['ATCG', 'GGCC'])
+
+    def test_xlsx(self):
+        self.assertUploads('.xlsx')
+
+    def test_csv(self):
+        self.assertUploads('.csv')
+
+    def test_tsv(self):
+        self.assertUploads('.tsv')
+
+    def test_without_import_export(self):
+        # Uploads only need the spreadsheet reader, not django-import-export
+        code = "import sys; sys.modules['import_export'] = sys.modules['tablib'] = None; import cardonalab.spreadsheets"
+        subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, check=True)
+
+class ExportResponseTests(SimpleTestCase):
+    HEADER = ['Name', 'Count', 'Added']
+    ROWS = [['Agar', 2, datetime.date(2022, 7, 1)], ['Lib "one"', None, None]]
+
+    def content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_csv(self):
+        response = csv_response('Lib "one".csv', self.HEADER, iter(self.ROWS))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], r'attachment; filename="Lib \"one\".csv"')
+        self.assertEqual(self.content(response).decode(), 'Name,Count,Added\r\nAgar,2,2022-07-01\r\n"Lib ""one""",,\r\n')
+
+    def test_ndjson(self):
+        response = ndjson_response('Bibliothèque.ndjson', self.HEADER, iter(self.ROWS))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=utf-8''Biblioth%C3%A8que.ndjson")
+        lines = self.content(response).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'Name': 'Agar', 'Count': 2, 'Added': '2022-07-01'},
+                                                                 {'Name': 'Lib "one"', 'Count': None, 'Added': None}])
+
+    def test_xlsx(self):
+        import openpyxl
+        response = xlsx_response('Bibliothèque "one".xlsx', self.HEADER, iter(self.ROWS), title="Stocks")
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=utf-8''Biblioth%C3%A8que%20%22one%22.xlsx")
+        workbook = openpyxl.load_workbook(io.BytesIO(self.content(response)))
+        self.assertEqual(workbook.sheetnames, ['Stocks'])
+        rows = [list(row) for row in workbook['Stocks'].iter_rows(values_only=True)]
+        self.assertEqual(rows, [self.HEADER, ['Agar', 2, datetime.datetime(2022, 7, 1)], ['Lib "one"', None, None]])
+
+class CrispriLibraryResourceTests(CardonalabTestCase):
+    def dataset(self, rows):
+        import tablib
+        header = ['boxNo', 'plate', 'wellLetter', 'wellNo', 'locusTag', 'downStreamGene', 'forwardPrimer', 'species',
+                  'resistance', 'essential', 'growthDefect', 'notes']
+        return tablib.Dataset(*rows, headers=header)
+
+    @override_settings(CARDONALAB_IMPORT_BATCH_SIZE=2)
+    def test_import(self):
+        # The batch size setting is read when the import runs
+        resource = CrispriLibraryResource()
+        self.assertEqual((resource._meta.batch_size, resource.get_chunk_size()), (2, 2))
+        rows = [['1', i // 12 + 1, 'ABCDEFGH'[i % 8], i % 12 + 1, 'MSMEG_%04d' % i, '', '', 'M. smegmatis', '', 'Y', 'N', '']
+                for i in range(5)]
+        result = resource.import_data(self.dataset(rows))
+        self.assertFalse(result.has_errors())
+        self.assertEqual(CrispriLibrary.objects.filter(essential=True, growthDefect=False).count(), 5)
+        # Importing the same wells again updates them
+        rows[0][4] = 'MSMEG_9999'
+        CrispriLibraryResource().import_data(self.dataset(rows))
+        self.assertEqual(CrispriLibrary.objects.count(), 5)
+        self.assertTrue(CrispriLibrary.objects.filter(locusTag='MSMEG_9999').exists())
+
+class CrispriFacetTests(CardonalabTestCase):
+    """The filter counts of the CRISPRi library follow every save and delete"""
+
+    def create(self, plate, species='M. smegmatis', **fields):
+        return CrispriLibrary.objects.create(boxNo='1', plate=plate, wellLetter='A', wellNo=1, species=species,
+                                             essential=fields.pop('essential', None), **fields)
+
+    def counts(self, field):
+        return dict(CrispriFacet.objects.filter(field=field, count__gt=0).values_list('value', 'count'))
+
+    def assertCounts(self, field, counts):
+        self.assertEqual(self.counts(field), counts)
+        # The same as counting the library from scratch
+        refresh_facets()
+        self.assertEqual(self.counts(field), counts)
+
+    def test_save(self):
+        self.create(1)
+        self.create(1, 'M. tuberculosis', essential=True)
+        self.create(2)
+        self.assertCounts('species', {'M. smegmatis': 2, 'M. tuberculosis': 1})
+        self.assertCounts('plate', {'1': 2, '2': 1})
+        self.assertCounts('essential', {'': 2, 'True': 1})
+
+    def test_change_field(self):
+        row = self.create(1)
+        self.create(1)
+        row.species = 'M. tuberculosis'
+        row.save()
+        self.assertCounts('species', {'M. smegmatis': 1, 'M. tuberculosis': 1})
+        self.assertCounts('plate', {'1': 2})
+
+    def test_delete(self):
+        row = self.create(1)
+        self.create(2)
+        row.delete()
+        self.assertCounts('species', {'M. smegmatis': 1})
+        self.assertCounts('plate', {'2': 1})
+
+    def test_filter_lists(self):
+        self.create(1)
+        self.create(1, 'M. tuberculosis')
+        # The filters and the count of a filtered page are read from the counts table, not counted from the library
+        CrispriFacet.objects.filter(field='species', value='M. smegmatis').update(count=41)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/cardonalab/crisprilibrary/', {'species': 'M. smegmatis'})
+        self.assertContains(response, 'M. smegmatis (41)')
+        self.assertContains(response, 'M. tuberculosis (1)')
+        self.assertContains(response, '41 results')
+        counts = [query['sql'] for query in queries if 'COUNT(' in query['sql'] and 'cardonalab_crisprilibrary' in query['sql']]
+        self.assertEqual(counts, [])
+
+class DetailQueryTests(CardonalabTestCase):
+    """Detail pages run a fixed number of queries however many related objects they list"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.manufacturer = Manufacturer.objects.create(name='Sigma')
+        cls.location = StorageLocation.objects.create(name='Fridge')
+        cls.chemicals = [cls.create_chemical('Acid %d' % i, manufacturer=cls.manufacturer, location=cls.location) for i in range(3)]
+        cls.primers = [cls.create_primer() for i in range(3)]
+        cls.plasmid = Plasmid.objects.create(name='pUC19', creator=cls.user)
+        cls.plasmid.primers.set(cls.primers)
+        cls.strain = Strain.objects.create(name='mc2155', species='M. smegmatis', creator=cls.user)
+        cls.stocks = [Stock.objects.create(strain=cls.strain, plasmid=cls.plasmid, creator=cls.user) for i in range(3)]
+        cls.tags = [Tag.objects.create(name='tag-%d' % i) for i in range(3)]
+        cls.protocol = Protocol.objects.create(title='Plating', body='', creator=cls.user)
+        cls.protocol.tags.set(cls.tags)
+        cls.genome = Genome.objects.create(title='Genome', body='', creator=cls.user)
+        for obj in [cls.plasmid, cls.strain, cls.protocol, cls.genome]:
+            for i in range(3):
+                File.objects.create(content_object=obj, file='files/%s-%d.txt' % (obj.pk, i))
+        cls.library = Library.objects.create(name='Library')
+        cls.libstock = cls.create_libstock(cls.library, '1', forward_primer=cls.primers[0])
+        cls.job = ImportJob.objects.create(creator=cls.user, kind=ImportJob.LIBRARY, source='upload.csv', library=cls.library,
+                                           status=ImportJob.DONE, result="Successfully created library")
+
+    def setUp(self):
+        super().setUp()
+        # Content types are looked up once per process, count the lookup whatever ran before
+        ContentType.objects.clear_cache()
+
+    # Counts include the session, the user and the page's version, and are the same with 1 or 100 related objects
+    def assertDetailQueries(self, count, model_name, obj):
+        url = '/cardonalab/%s/%d/view/' % (model_name, obj.pk)
+        with self.assertNumQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_manufacturer(self):
+        self.assertDetailQueries(6, 'manufacturer', self.manufacturer)
+
+    def test_storagelocation(self):
+        self.assertDetailQueries(6, 'storagelocation', self.location)
+
+    def test_chemical(self):
+        self.assertDetailQueries(6, 'chemical', self.chemicals[0])
+
+    def test_primer(self):
+        self.assertDetailQueries(6, 'primer', self.primers[0])
+
+    def test_plasmid(self):
+        self.assertDetailQueries(10, 'plasmid', self.plasmid)
+
+    def test_strain(self):
+        self.assertDetailQueries(9, 'strain', self.strain)
+
+    def test_stock(self):
+        self.assertDetailQueries(6, 'stock', self.stocks[0])
+
+    def test_tag(self):
+        self.assertDetailQueries(6, 'tag', self.tags[0])
+
+    def test_protocol(self):
+        self.assertDetailQueries(10, 'protocol', self.protocol)
+
+    def test_libstock(self):
+        self.assertDetailQueries(5, 'libstock', self.libstock)
+
+    def test_genome(self):
+        self.assertDetailQueries(8, 'genome', self.genome)
+
+    def test_importjob(self):
+        self.assertDetailQueries(3, 'importjob', self.job)
+
+class ConditionalDetailTests(CardonalabTestCase):
+    """Detail pages answer a browser's revalidation with 304 until the page would change"""
+
+    def setUp(self):
+        super().setUp()
+        self.manufacturer = Manufacturer.objects.create(name='Sigma')
+        self.chemical = self.create_chemical('Agar', manufacturer=self.manufacturer)
+        self.url = '/cardonalab/chemical/%d/view/' % self.chemical.pk
+
+    def revalidate(self, etag):
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.revalidate(response['ETag']).status_code, 304)
+
+    def test_object_changed(self):
+        etag = self.client.get(self.url)['ETag']
+        self.chemical.in_stock = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chemical.save()
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_related_object_changed(self):
+        # Manufacturers have no updated time, the page's version covers the name it shows
+        etag = self.client.get(self.url)['ETag']
+        self.manufacturer.name = 'Merck'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manufacturer.save()
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Merck')
+
+    def test_related_tag_renamed(self):
+        # Nor do tags or files, the version of a protocol's page covers the ones it lists
+        protocol = Protocol.objects.create(title='Plating', body='', creator=self.user)
+        tag = Tag.objects.create(name='media')
+        protocol.tags.add(tag)
+        url = '/cardonalab/protocol/%d/view/' % protocol.pk
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        tag.name = 'agar'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'agar')
+        etag = response['ETag']
+        File.objects.create(content_object=protocol, file='files/steps.txt')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bookmark_changed(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.get('/cardonalab/chemical/%d/add_bookmark/' % self.chemical.pk)
+        # The page showing the "Bookmark added" message is never cached
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Remove Bookmark')
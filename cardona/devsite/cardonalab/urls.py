@@ -1,8 +1,9 @@
+from django.contrib import admin
 from django.urls import path
 
 from . import views
 
 app_name = 'cardonalab'
 urlpatterns = [
-    path('bookmarks/', views.bookmarks_view, name='bookmarks')
+    path('bookmarks/', admin.site.admin_view(views.bookmarks_view), name='bookmarks')
 ]
\ No newline at end of file
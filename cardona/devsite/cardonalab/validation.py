@@ -0,0 +1,276 @@
+import string
+from collections import namedtuple
+
+import numpy as np
+
+from .spreadsheets import SpreadsheetError, open_sheet
+
+# Bounds used when checking uploaded sheets
+TM_RANGE = (0, 100)
+WELL_LETTERS = "ABCDEFGHIJKLMNOP" # up to 384-well plates
+WELL_NUMBERS = (1, 24)
+MAX_PLATE = 32767
+MAX_LENGTH = 255
+MAX_URL_LENGTH = 200 # Django's default for URLField
+
+# Same characters as the pattern in Primer.clean, which has always let commas through
+PRIMER_ALPHABET = "ATCGNRY,"
+
+PRIMER_COLUMNS = ['Sequence', 'Tm', 'Template', 'Location', 'Restriction sites', 'Notes']
+CHEMICAL_COLUMNS = ['Name', 'Label', 'Manufacturer', 'Location', 'In stock', 'MSDS link', 'Notes']
+LIBRARY_COLUMNS = ['Stock ID', 'Plate #', 'Well Letter', 'Well #', 'Species', 'Gene Target', 'Forward Primer', 'Resistance', 'Notes']
+
+# Spellings accepted for yes/no columns, compared in lowercase
+YES_VALUES = ['y', 'yes', 'true', '1']
+NO_VALUES = ['n', 'no', 'false', '0']
+
+# sheet is only set for workbooks that are checked sheet by sheet
+CellError = namedtuple('CellError', ['row', 'column', 'message', 'sheet'], defaults=[None])
+
+class SheetReport:
+    # One problem per row and column. Rows count the header as row 1, as in Excel.
+    def __init__(self, nrows, first_row=2, sheet=None):
+        self.nrows = nrows
+        self.first_row = first_row
+        self.sheets = [] if sheet is None else [sheet]
+        self.errors = []
+        # (row, sheet) of every checked row, only needed once reports of several sheets are combined
+        self.locations = None
+
+    @classmethod
+    def combine(cls, reports):
+        """Merges the reports of several sheets, in the order their columns were concatenated"""
+        combined = cls(sum(report.nrows for report in reports))
+        combined.locations = []
+        for report in reports:
+            sheet = report.sheets[0] if report.sheets else None
+            combined.sheets.extend(report.sheets)
+            combined.errors.extend(report.errors)
+            combined.locations.extend((i + report.first_row, sheet) for i in range(report.nrows))
+        return combined
+
+    def add(self, mask, column, message):
+        """Records message for every row where mask is True"""
+        for i in np.flatnonzero(mask):
+            if self.locations is not None:
+                row, sheet = self.locations[i]
+            else:
+                row, sheet = int(i) + self.first_row, (self.sheets[0] if self.sheets else None)
+            self.errors.append(CellError(row, column, message, sheet))
+
+    @property
+    def rows(self):
+        """Rows with problems, as "Sheet!row" when the report covers several sheets"""
+        rows = []
+        for error in self.sorted_errors():
+            row = "%s!%d" % (error.sheet, error.row) if len(self.sheets) > 1 else error.row
+            if row not in rows[-1:]:
+                rows.append(row)
+        return rows
+
+    def sorted_errors(self):
+        return sorted(self.errors, key=lambda error: (self.sheets.index(error.sheet) if error.sheet in self.sheets else 0, error.row))
+
+    def __bool__(self):
+        return bool(self.errors)
+
+### Column conversions, each working on a whole column at once
+
+def _columns(rows, width):
+    """Transposes rows into one object array per column, padding short rows with ''"""
+    table = np.full((len(rows), width), '', dtype=object)
+    for i, row in enumerate(rows):
+        row = row[:width]
+        table[i, :len(row)] = row
+    return [table[:, j] for j in range(width)]
+
+def _text(column):
+    # Same conversion as str() on every cell
+    return column.astype(str)
+
+def _to_float(value):
+    if value == '' or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+_floats = np.frompyfunc(_to_float, 1, 1)
+
+def _numbers(column):
+    """Converts a column to floats, with NaN for empty or non-numeric cells"""
+    return _floats(column).astype(float)
+
+def _integers(column):
+    """Returns the column as integers and a mask of the cells that aren't whole numbers"""
+    numbers = _numbers(column)
+    invalid = ~np.isfinite(numbers) | (numbers != np.round(numbers))
+    integers = np.where(invalid, 0, numbers).astype(np.int64)
+    return integers, invalid
+
+def _check_length(report, values, column, required=False):
+    lengths = np.char.str_len(values)
+    if required:
+        report.add(lengths == 0, column, "is required")
+    report.add(lengths > MAX_LENGTH, column, "is longer than %d characters" % MAX_LENGTH)
+
+### Primers
+
+def check_primer_sheet(rows):
+    # Returns the cleaned columns keyed by field name, and a SheetReport
+    columns = _columns(rows, len(PRIMER_COLUMNS))
+    report = SheetReport(len(rows))
+
+    sequence = np.char.upper(_text(columns[0]))
+    _check_length(report, sequence, 'Sequence', required=True)
+    leftover = np.char.translate(sequence, str.maketrans('', '', PRIMER_ALPHABET))
+    report.add(np.char.str_len(leftover) > 0, 'Sequence', "is not a valid DNA sequence")
+
+    tm = _numbers(columns[1])
+    report.add(np.isnan(tm), 'Tm', "must be a number")
+    report.add((tm < TM_RANGE[0]) | (tm > TM_RANGE[1]), 'Tm', "must be between %d and %d" % TM_RANGE)
+
+    cleaned = {'sequence': sequence, 'tm': tm}
+    for j, field in [(2, 'template'), (3, 'location'), (4, 'restriction_sites')]:
+        cleaned[field] = _text(columns[j])
+        _check_length(report, cleaned[field], PRIMER_COLUMNS[j])
+    cleaned['notes'] = _text(columns[5])
+    return cleaned, report
+
+### Chemicals
+
+def default_label(name):
+    # As the chemical form suggests: the first letter not followed by a dash, so "L-Arginine" gets "A"
+    for i, char in enumerate(name):
+        if char.isascii() and char.isalpha() and name[i + 1:i + 2] != '-':
+            return char.upper()
+    return ''
+
+_default_labels = np.frompyfunc(default_label, 1, 1)
+
+def check_chemical_sheet(rows):
+    # Manufacturers and locations are returned as names; empty labels are filled in from the name
+    columns = _columns(rows, len(CHEMICAL_COLUMNS))
+    report = SheetReport(len(rows))
+
+    name = np.char.strip(_text(columns[0]))
+    _check_length(report, name, 'Name', required=True)
+
+    label = np.char.upper(np.char.strip(_text(columns[1])))
+    empty = label == ''
+    if empty.any():
+        label = np.where(empty, _default_labels(name).astype(str), label)
+    invalid_label = ~np.isin(label, list(string.ascii_uppercase))
+    report.add(invalid_label & ~empty, 'Label', "must be a single letter")
+    report.add(invalid_label & empty & (name != ''), 'Label', "is required when the name has no letters")
+
+    cleaned = {'name': name, 'label': label}
+    for j, field in [(2, 'manufacturer'), (3, 'location')]:
+        cleaned[field] = np.char.strip(_text(columns[j]))
+        _check_length(report, cleaned[field], CHEMICAL_COLUMNS[j])
+
+    in_stock = np.char.lower(np.char.strip(_text(columns[4])))
+    report.add(~np.isin(in_stock, [''] + YES_VALUES + NO_VALUES), 'In stock', "must be Y or N")
+    # Chemicals are in stock unless the sheet says otherwise
+    cleaned['in_stock'] = ~np.isin(in_stock, NO_VALUES)
+
+    msds = np.char.strip(_text(columns[5]))
+    has_msds = msds != ''
+    report.add(has_msds & ~(np.char.startswith(msds, 'http://') | np.char.startswith(msds, 'https://')), 'MSDS link',
+               "must be a link starting with http:// or https://")
+    report.add(np.char.str_len(msds) > MAX_URL_LENGTH, 'MSDS link', "is longer than %d characters" % MAX_URL_LENGTH)
+    cleaned['msds'] = msds
+    cleaned['notes'] = _text(columns[6])
+    return cleaned, report
+
+### Libraries
+
+def _stock_ids(column):
+    # Excel stores numeric stock ids as floats, which should read "12" rather than "12.0"
+    numbers = _numbers(column)
+    whole = np.isfinite(numbers) & (numbers == np.round(numbers))
+    stock_ids = _text(column).astype(object)
+    stock_ids[whole] = [str(int(number)) for number in numbers[whole]]
+    return stock_ids.astype(str)
+
+def _wells(plate, letter, number):
+    return np.char.add(np.char.add(plate.astype(str), "-"), np.char.add(letter, number.astype(str)))
+
+def check_library_sheet(rows, first_row=2, sheet=None):
+    # Forward primers are only checked to be whole numbers here; check_primer_references looks them up
+    columns = _columns(rows, len(LIBRARY_COLUMNS))
+    report = SheetReport(len(rows), first_row, sheet)
+
+    stock_id = _stock_ids(columns[0])
+    _check_length(report, stock_id, 'Stock ID', required=True)
+
+    plate, invalid_plate = _integers(columns[1])
+    report.add(invalid_plate, 'Plate #', "must be a whole number")
+    report.add(~invalid_plate & ((plate < 0) | (plate > MAX_PLATE)), 'Plate #', "must be between 0 and %d" % MAX_PLATE)
+
+    letter = np.char.upper(np.char.strip(_text(columns[2])))
+    invalid_letter = ~np.isin(letter, list(WELL_LETTERS))
+    report.add(invalid_letter, 'Well Letter', "must be a letter from A to %s" % WELL_LETTERS[-1])
+
+    number, invalid_number = _integers(columns[3])
+    invalid_number |= (number < WELL_NUMBERS[0]) | (number > WELL_NUMBERS[1])
+    report.add(invalid_number, 'Well #', "must be a whole number from %d to %d" % WELL_NUMBERS)
+
+    # A well can only hold one stock
+    valid_well = ~(invalid_plate | invalid_letter | invalid_number)
+    _, inverse, counts = np.unique(_wells(plate, letter, number), return_inverse=True, return_counts=True)
+    report.add(valid_well & (counts[inverse] > 1), 'Well', "is used by more than one row")
+
+    species = _text(columns[4])
+    _check_length(report, species, 'Species', required=True)
+
+    primer_cells = columns[6]
+    has_primer = _text(primer_cells) != ''
+    primer_id, invalid_primer = _integers(primer_cells)
+    invalid_primer |= primer_id < 1
+    report.add(has_primer & invalid_primer, 'Forward Primer', "must be a primer id")
+
+    cleaned = {'stock_id': stock_id, 'plate': plate, 'letter': letter, 'number': number, 'species': species,
+               'forward_primer_id': np.where(has_primer & ~invalid_primer, primer_id, 0)}
+    for j, field in [(5, 'gene_target'), (7, 'resistance')]:
+        cleaned[field] = _text(columns[j])
+        _check_length(report, cleaned[field], LIBRARY_COLUMNS[j])
+    cleaned['notes'] = _text(columns[8])
+    return cleaned, report
+
+def check_library_workbook_sheet(source, sheet, name=None):
+    # Runs in worker processes, so it must not use the database. Returns None for an empty sheet.
+    header, rows = open_sheet(source, name, sheet=sheet)
+    if not header:
+        return None
+    if len(header) != len(LIBRARY_COLUMNS):
+        raise SpreadsheetError('Sheet "%s" has %d columns instead of %d' % (sheet, len(header), len(LIBRARY_COLUMNS)))
+    return check_library_sheet(list(rows), sheet=sheet)
+
+def merge_library_sheets(results):
+    # Wells are checked again across sheets, since check_library_sheet only sees its own sheet
+    cleaned = {field: np.concatenate([columns[field] for columns, _ in results]) for field in results[0][0]}
+    report = SheetReport.combine([sheet_report for _, sheet_report in results])
+    if report.nrows == 0:
+        return cleaned, report
+
+    sheet_index = np.concatenate([np.full(sheet_report.nrows, i) for i, (_, sheet_report) in enumerate(results)])
+    invalid = set((error.row, error.sheet) for error in report.errors if error.column in LIBRARY_COLUMNS[1:4])
+    valid_well = np.array([location not in invalid for location in report.locations], dtype=bool)
+    _, inverse = np.unique(_wells(cleaned['plate'], cleaned['letter'], cleaned['number']), return_inverse=True)
+    inverse = inverse.ravel()
+    first = np.full(inverse.max() + 1, len(results))
+    last = np.full(inverse.max() + 1, -1)
+    np.minimum.at(first, inverse[valid_well], sheet_index[valid_well])
+    np.maximum.at(last, inverse[valid_well], sheet_index[valid_well])
+    report.add(valid_well & (first[inverse] != last[inverse]), 'Well', "is also used on another sheet")
+    return cleaned, report
+
+def check_primer_references(cleaned, report):
+    """Reports forward primers that don't exist, using a single query for the whole sheet"""
+    from .models import Primer # imported here so worker processes can use this module without setting up Django
+    primer_ids = cleaned['forward_primer_id']
+    referenced = np.unique(primer_ids[primer_ids > 0])
+    existing = np.fromiter(Primer.objects.filter(pk__in=referenced.tolist()).values_list('pk', flat=True), dtype=np.int64)
+    report.add((primer_ids > 0) & ~np.isin(primer_ids, existing), 'Forward Primer', "does not exist")
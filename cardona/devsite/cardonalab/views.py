@@ -1,176 +1,162 @@
-from django.shortcuts import render
+import time
+
+from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.http import HttpResponseRedirect, HttpResponse
 from django import forms
 from django.contrib import messages
 from django.contrib import admin
-from django.contrib.admin.models import LogEntry, ADDITION
-from django.contrib.contenttypes.models import ContentType
 
-from .models import Primer, Library, LibStock
+from .models import Library, ImportJob
+from .jobs import start_job
+from .bookmarks import get_bookmarked_objects
+from .importers import PRIMER_COLUMNS, LIBRARY_COLUMNS, CHEMICAL_COLUMNS, check_primers, check_chemicals, check_library, check_library_workbook, get_batch_size
+from .validation import LIBRARY_COLUMNS as LIBRARY_HEADER
+from .exports import csv_response, xlsx_response
+from .plates import get_plate_map
+from .spreadsheets import SpreadsheetError, SUPPORTED_EXTENSIONS, open_sheet, sheet_names
+
+def _check_file_view(request, form, template, columns, check, **extra_context):
+    """Renders an upload page with a report of every problem in the uploaded sheet, without importing anything"""
+    excel_file = form.cleaned_data['excel_file']
+    context = dict(extra_context, form=form, checked_file=excel_file.name)
+    try:
+        header, rows = open_sheet(excel_file)
+        if len(header) == columns:
+            rows = list(rows)
+            start = time.monotonic()
+            cleaned, context['report'] = check(rows)
+            context['check_time'] = time.monotonic() - start
+        else:
+            messages.error(request, 'Incorrect number of columns in file "' + excel_file.name + '"')
+    except SpreadsheetError:
+        messages.error(request, 'Failed to read file "' + excel_file.name + '"')
+    return render(request, template, context)
+
+def _check_library_file_view(request, form, template, **extra_context):
+    """Like _check_file_view, checking every sheet of library workbooks with more than one sheet"""
+    excel_file = form.cleaned_data['excel_file']
+    try:
+        multiple_sheets = len(sheet_names(excel_file)) > 1
+    except SpreadsheetError:
+        multiple_sheets = False # let _check_file_view report it
+    if not multiple_sheets:
+        return _check_file_view(request, form, template, LIBRARY_COLUMNS, check_library, **extra_context)
+
+    context = dict(extra_context, form=form, checked_file=excel_file.name)
+    try:
+        start = time.monotonic()
+        cleaned, context['report'] = check_library_workbook(excel_file)
+        context['check_time'] = time.monotonic() - start
+    except SpreadsheetError as e:
+        messages.error(request, 'Failed to read file "%s": %s' % (excel_file.name, e))
+    return render(request, template, context)
 
 class PrimerAddMultipleForm(forms.Form):
-    excel_file = forms.FileField(label="Upload file:")
+    excel_file = forms.FileField(label="Upload file:", widget=forms.ClearableFileInput(attrs={'accept': ",".join(SUPPORTED_EXTENSIONS)}))
+    validate_only = forms.BooleanField(label="Only check the file, don't import it:", required=False)
 
 def primer_add_multiple_view(request):
     if request.method == 'POST':
         form = PrimerAddMultipleForm(request.POST, request.FILES)
+        if form.is_valid() and form.cleaned_data['validate_only']:
+            return _check_file_view(request, form, 'cardonalab/primer_add_multiple.html', PRIMER_COLUMNS, check_primers)
         if form.is_valid():
-            excel_file = request.FILES['excel_file']
-            try:
-                import xlrd
-                sheet = xlrd.open_workbook(file_contents=excel_file.read()).sheet_by_index(0)
-
-                if sheet.ncols == 6:
-                    primers = []
-                    errors = []
-                    for i in range(1, sheet.nrows):
-                        row = sheet.row_values(i)
-                        try:
-                            new_primer = Primer(creator=request.user,
-                                                sequence=str(row[0]),
-                                                tm=float(row[1]),
-                                                template=str(row[2]),
-                                                location=str(row[3]),
-                                                restriction_sites=str(row[4]),
-                                                notes=row[5])
-                            new_primer.full_clean()
-                            primers.append(new_primer)
-                        except:
-                            errors.append(i + 1)
-                    
-                    if not errors:
-                        for new_primer in primers:
-                            new_primer.save()
-                            LogEntry.objects.log_action(
-                                user_id=request.user.id,
-                                content_type_id=ContentType.objects.get_for_model(new_primer).pk,
-                                object_id=new_primer.id,
-                                object_repr=str(new_primer),
-                                action_flag=ADDITION,
-                                change_message="Added via Excel file with primers %d - %d" % (primers[0].id, primers[0].id + len(primers) - 1)
-                            )
-                        messages.success(request, "Successfully created " + str(sheet.nrows-1) + " primers from file")
-                    else:
-                        messages.error(request, "File contains errors in the following row(s): " + str(errors))
-                else:
-                    messages.error(request, 'Incorrect number of columns in file "' + excel_file.name + '"')
-            except xlrd.biffh.XLRDError:
-                messages.error(request, 'Failed to read file "' + excel_file.name + '"')
-            
-            return HttpResponseRedirect('/cardonalab/primer')
+            job = ImportJob.objects.create(creator=request.user, kind=ImportJob.PRIMERS, source=request.FILES['excel_file'])
+            start_job(job)
+            messages.success(request, "Import started, this page will update as the file is processed")
+            return HttpResponseRedirect(reverse('admin:ImportJob_view', args=[job.id]))
 
     else:
         form = PrimerAddMultipleForm()
     
     return render(request, 'cardonalab/primer_add_multiple.html', {'form': form})
 
+class ChemicalAddMultipleForm(forms.Form):
+    excel_file = forms.FileField(label="Upload file:", widget=forms.ClearableFileInput(attrs={'accept': ",".join(SUPPORTED_EXTENSIONS)}))
+    validate_only = forms.BooleanField(label="Only check the file, don't import it:", required=False)
+
+def chemical_add_multiple_view(request):
+    if request.method == 'POST':
+        form = ChemicalAddMultipleForm(request.POST, request.FILES)
+        if form.is_valid() and form.cleaned_data['validate_only']:
+            return _check_file_view(request, form, 'cardonalab/chemical_add_multiple.html', CHEMICAL_COLUMNS, check_chemicals)
+        if form.is_valid():
+            job = ImportJob.objects.create(creator=request.user, kind=ImportJob.CHEMICALS, source=request.FILES['excel_file'])
+            start_job(job)
+            messages.success(request, "Import started, this page will list the codes of the new chemicals once it is done")
+            return HttpResponseRedirect(reverse('admin:ImportJob_view', args=[job.id]))
+
+    else:
+        form = ChemicalAddMultipleForm()
+
+    return render(request, 'cardonalab/chemical_add_multiple.html', {'form': form})
+
 class CreateLibraryForm(forms.Form):
     library_name = forms.CharField(label="Library Name:")
-    excel_file = forms.FileField(label="Upload file:")
+    excel_file = forms.FileField(label="Upload file:", widget=forms.ClearableFileInput(attrs={'accept': ",".join(SUPPORTED_EXTENSIONS)}))
+    validate_only = forms.BooleanField(label="Only check the file, don't import it:", required=False)
 
 def create_library_view(request):
     if request.method == 'POST':
         form = CreateLibraryForm(request.POST, request.FILES)
+        if form.is_valid() and form.cleaned_data['validate_only']:
+            return _check_library_file_view(request, form, 'cardonalab/create_library.html')
         if form.is_valid():
-            excel_file = request.FILES['excel_file']
-            try:
-                import xlrd
-                sheet = xlrd.open_workbook(file_contents=excel_file.read()).sheet_by_index(0)
-
-                if sheet.ncols == 9:
-                    library = Library(name=form.cleaned_data['library_name'])
-                    library.save()
-                    stocks = []
-                    errors = []
-                    for i in range(1, sheet.nrows):
-                        row = sheet.row_values(i)
-                        try:
-                            if row[6]:
-                                primer = Primer.objects.get(pk=row[6])
-                            else:
-                                primer = None
-                            try:
-                                stock_id = int(row[0])
-                            except:
-                                stock_id = str(row[0])
-
-                            new_stock = LibStock(
-                                library=library,
-                                stock_id=stock_id,
-                                plate=row[1],
-                                letter=row[2],
-                                number=row[3],
-                                species=row[4],
-                                gene_target=row[5],
-                                forward_primer=primer,
-                                resistance=row[7],
-                                notes=row[8])
-                            new_stock.full_clean()
-                            stocks.append(new_stock)
-                        except:
-                            errors.append(i + 1)
-                    
-                    if not errors:
-                        LogEntry.objects.log_action(
-                            user_id=request.user.id,
-                            content_type_id=ContentType.objects.get_for_model(library).pk,
-                            object_id=library.id,
-                            object_repr=str(library),
-                            action_flag=ADDITION,
-                            change_message="Added."
-                        )
-                        for new_stock in stocks:
-                            new_stock.save()
-                            LogEntry.objects.log_action(
-                                user_id=request.user.id,
-                                content_type_id=ContentType.objects.get_for_model(new_stock).pk,
-                                object_id=new_stock.id,
-                                object_repr=str(new_stock),
-                                action_flag=ADDITION,
-                                change_message="Added."
-                            )
-                        messages.success(request, "Successfully created library with " + str(sheet.nrows-1) + " stocks from file")
-                    else:
-                        library.delete()
-                        messages.error(request, "File contains errors in the following row(s): " + str(errors))
-                else:
-                    messages.error(request, 'Incorrect number of columns in file "' + excel_file.name + '"')
-            except xlrd.biffh.XLRDError:
-                messages.error(request, 'Failed to read file "' + excel_file.name + '"')
-            
-            return HttpResponseRedirect('/cardonalab/library')
+            job = ImportJob.objects.create(creator=request.user, kind=ImportJob.LIBRARY, source=request.FILES['excel_file'],
+                                           library_name=form.cleaned_data['library_name'])
+            start_job(job)
+            messages.success(request, "Import started, this page will update as the file is processed")
+            return HttpResponseRedirect(reverse('admin:ImportJob_view', args=[job.id]))
 
     else:
         form = CreateLibraryForm()
     
     return render(request, 'cardonalab/create_library.html', {'form': form})
 
+class UpdateLibraryForm(forms.Form):
+    excel_file = forms.FileField(label="Upload file:", widget=forms.ClearableFileInput(attrs={'accept': ",".join(SUPPORTED_EXTENSIONS)}))
+    remove_missing = forms.BooleanField(label="Remove stocks that are not in the file:", required=False, initial=True)
+    validate_only = forms.BooleanField(label="Only check the file, don't import it:", required=False)
+
+def update_library_view(request, id):
+    library = get_object_or_404(Library, pk=id)
+    if request.method == 'POST':
+        form = UpdateLibraryForm(request.POST, request.FILES)
+        if form.is_valid() and form.cleaned_data['validate_only']:
+            return _check_library_file_view(request, form, 'cardonalab/update_library.html', library=library)
+        if form.is_valid():
+            job = ImportJob.objects.create(creator=request.user, kind=ImportJob.LIBRARY_UPDATE, source=request.FILES['excel_file'],
+                                           library=library, library_name=library.name, remove_missing=form.cleaned_data['remove_missing'])
+            start_job(job)
+            messages.success(request, "Import started, this page will update as the file is processed")
+            return HttpResponseRedirect(reverse('admin:ImportJob_view', args=[job.id]))
+
+    else:
+        form = UpdateLibraryForm()
+    
+    return render(request, 'cardonalab/update_library.html', {'form': form, 'library': library})
+
+def export_library_view(request, id):
+    """Streams every stock of a library in the layout of Library_Template.xlsx, so the file can be uploaded again"""
+    library = get_object_or_404(Library, pk=id)
+    fields = ['stock_id', 'plate', 'letter', 'number', 'species', 'gene_target', 'forward_primer_id', 'resistance', 'notes']
+    stocks = library.libstock_set.order_by('plate', 'letter', 'number', 'stock_id').values_list(*fields)
+    rows = (['' if value is None else value for value in stock] for stock in stocks.iterator(chunk_size=get_batch_size()))
+    if request.GET.get('format') == 'xlsx':
+        return xlsx_response(library.name + ".xlsx", LIBRARY_HEADER, rows)
+    return csv_response(library.name + ".csv", LIBRARY_HEADER, rows)
+
+def plate_map_view(request, id, plate=None):
+    """Shows one plate of a library as a grid of wells, the library's first plate by default"""
+    library = get_object_or_404(Library, pk=id)
+    plates = list(library.libstock_set.order_by('plate').values_list('plate', flat=True).distinct())
+    if plate is None and plates:
+        plate = plates[0]
+    context = dict(admin.site.each_context(request), library=library, plates=plates, plate=plate,
+                   plate_map=get_plate_map(library, plate) if plate in plates else None)
+    return render(request, 'cardonalab/plate_map.html', context)
+
 def bookmarks_view(request):
-    bookmarks = {'chemicals':[], 'manufacturers':[], 'locations':[], 'primers':[], 'plasmids':[], 'strains':[], 'stocks':[], 'libstocks':[], 'genomes':[], 'protocols':[], 'tags':[]}
-
-    for bookmark in request.user.bookmark_set.all():
-        if bookmark.content_type.model == 'chemical':
-            bookmarks['chemicals'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'manufacturer':
-            bookmarks['manufacturers'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'storagelocation':
-            bookmarks['locations'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'primer':
-            bookmarks['primers'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'plasmid':
-            bookmarks['plasmids'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'strain':
-            bookmarks['strains'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'stock':
-            bookmarks['stocks'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'libstock':
-            bookmarks['libstocks'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'genome':
-            bookmarks['genomes'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'protocol':
-            bookmarks['protocols'].append(bookmark.content_object)
-        elif bookmark.content_type.model == 'tag':
-            bookmarks['tags'].append(bookmark.content_object)
-
-    context = dict(admin.site.each_context(request), bookmarks=bookmarks)
+    context = dict(admin.site.each_context(request), bookmarks=get_bookmarked_objects(request.user))
     return render(request, 'cardonalab/bookmarks.html', context)
\ No newline at end of file
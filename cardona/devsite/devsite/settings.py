@@ -121,4 +121,42 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
-MEDIA_URL = "/media/"
\ No newline at end of file
+MEDIA_URL = "/media/"
+
+# Cardona lab bulk spreadsheet imports
+
+CARDONALAB_IMPORT_BATCH_SIZE = 500
+
+# Uploads are kept here until their import job finishes
+CARDONALAB_IMPORT_SPOOL_DIR = os.path.join(BASE_DIR, "import_spool")
+# A running job whose heartbeat stops for this many seconds is taken to be interrupted. The import runner resumes it,
+# along with any jobs still pending, whenever a job is queued, on every pass of run_import_jobs and, with
+# CARDONALAB_IMPORT_START_RUNNER, when the site starts.
+CARDONALAB_IMPORT_STALE_AFTER = 300
+
+# 'thread' runs imports in a background thread pool of the web server process, 'command' leaves them for
+# "python manage.py run_import_jobs --loop"
+CARDONALAB_IMPORT_RUNNER = 'thread'
+CARDONALAB_IMPORT_WORKERS = 1
+# Whether the 'thread' runner picks up the jobs left by the last restart as soon as Django starts. This happens in every
+# process that loads the site, management commands included, so only turn it on in the web server's settings.
+CARDONALAB_IMPORT_START_RUNNER = False
+
+# Processes used to check the sheets of large multi-sheet library workbooks, None for one per CPU
+CARDONALAB_IMPORT_PROCESSES = None
+# Workbooks smaller than this many bytes have their sheets checked in the importing process, as starting the worker
+# processes takes longer
+CARDONALAB_IMPORT_PARALLEL_MIN_SIZE = 1024 * 1024
+
+# Changelists with keyset pagination show row counts up to this many seconds old instead of counting every request
+CARDONALAB_COUNT_TIMEOUT = 300
+
+# Bookmarks are cached per user and detail pages keep their rendered object_body in the cache, cleared whenever what
+# they show changes. The local-memory cache is private to each process, so changes made in one process leave stale
+# pages in the others: switch to a shared cache (Memcached, Redis or the database cache) when the site is served by
+# several processes or imports run with CARDONALAB_IMPORT_RUNNER = 'command'. "manage.py check" warns about the latter.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -7,6 +7,7 @@ from django.conf.urls.static import static
 admin.site.site_header = "Cardona Lab Database"
 
 urlpatterns = [
-    path('', admin.site.urls),
-    path('cardonalab/', include('cardonalab.urls'))
+    # before the admin, whose catch-all view would otherwise answer these URLs with a 404
+    path('cardonalab/', include('cardonalab.urls')),
+    path('', admin.site.urls)
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file